@@ -6,16 +6,20 @@ The script performs the following steps:
 1.  Read a CSV file that must contain a column named ``prompt``. If an
     ``act`` column is present it is used purely for reporting purposes.
 2.  Create embeddings via the OpenAI API (``text-embedding-3-small`` by
-    default).  The user can optionally provide a JSON cache path so the
-    expensive embedding step is only executed for new / unseen texts.
+    default) or one of the local backends (offline hashing embedder,
+    sentence‑transformers, deterministic fake vectors).  The user can
+    optionally provide a cache path so the expensive embedding step is only
+    executed for new / unseen texts.  The cache is a memory‑mapped float32
+    matrix; legacy JSON caches are imported on first use.
 3.  Cluster the resulting vectors either with K‑Means (automatically picking
-    *k* through the silhouette score) or with DBSCAN.  Outliers are flagged
-    as cluster ``-1`` when DBSCAN is selected.
+    *k* through a sampled silhouette score or a cheaper criterion), its
+    streaming mini‑batch variant for very large corpora, or with DBSCAN.
+    Outliers are flagged as cluster ``-1`` when DBSCAN is selected.
 4.  Ask a Chat Completion model (``gpt-4o-mini`` by default) to come up with a
     short name and description for every cluster.
 5.  Write a human‑readable Markdown report (default: ``analysis.md``).
-6.  Generate a couple of diagnostic plots (cluster sizes and a t‑SNE scatter
-    plot) and store them in ``plots/``.
+6.  Generate a couple of diagnostic plots (cluster sizes and a 2‑D scatter
+    plot – t‑SNE, PCA or UMAP) and store them in ``plots/``.
 
 The script is intentionally opinionated yet configurable via a handful of CLI
 options – run ``python cluster_prompts.py --help`` for details.
@@ -24,10 +28,32 @@ options – run ``python cluster_prompts.py --help`` for details.
 from __future__ import annotations
 
 import argparse
+import asyncio
+import contextlib
+import contextvars
+import functools
+import hashlib
 import json
+import multiprocessing
+import os
+import random
+import re
 import sys
+import tempfile
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Sequence
+from typing import IO, Any, Callable, Sequence
 
 import numpy as np
 import pandas as pd
@@ -45,28 +71,146 @@ def parse_cli() -> argparse.Namespace:  # noqa: D401
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
 
-    parser.add_argument("--csv", type=Path, default=Path("prompts.csv"), help="Input CSV file.")
+    parser.add_argument(
+        "--csv",
+        type=Path,
+        default=Path("prompts.csv"),
+        help="Input file: CSV, or JSONL / Parquet by extension.",
+    )
+    parser.add_argument(
+        "--read-chunk-rows",
+        type=int,
+        default=100_000,
+        help="Rows read per chunk while streaming and deduplicating the input.",
+    )
     parser.add_argument(
         "--cache",
         type=Path,
         default=None,
-        help="Optional JSON cache for embeddings (will be created if it does not exist).",
+        help=(
+            "Optional embedding cache directory (created if it does not exist). A path "
+            "ending in .json is treated as a legacy JSON cache and imported once into a "
+            "binary store next to it."
+        ),
     )
     parser.add_argument(
-        "--embedding-model",
+        "--legacy-cache-model",
         default="text-embedding-3-small",
-        help="OpenAI embedding model to use.",
+        help="OpenAI model that produced a legacy .json --cache; its vectors are only imported "
+        "for runs using that model at native dimensions.",
+    )
+    parser.add_argument(
+        "--embedding-backend",
+        choices=list(EMBEDDING_BACKENDS),
+        default="openai",
+        help="Embedding provider: the OpenAI API, an offline hashing embedder, a local "
+        "sentence-transformers model, or deterministic fake vectors for tests.",
+    )
+    parser.add_argument(
+        "--embedding-model",
+        default=None,
+        help="Embedding model; defaults to text-embedding-3-small (openai) or "
+        "all-MiniLM-L6-v2 (sentence-transformers).",
+    )
+    parser.add_argument(
+        "--embedding-threads",
+        type=int,
+        default=None,
+        help="Worker threads for local embedding backends (default: one per CPU; one for "
+        "sentence-transformers, which parallelises internally).",
+    )
+    parser.add_argument(
+        "--embedding-dimensions",
+        type=int,
+        default=None,
+        help="Request shortened embeddings with this many dimensions (text-embedding-3-* only).",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=float,
+        default=None,
+        help="Evict least recently used cached embeddings once the cache exceeds this size.",
+    )
+    parser.add_argument(
+        "--cache-max-age-days",
+        type=float,
+        default=None,
+        help="Evict cached embeddings that have not been used for this many days.",
     )
     parser.add_argument(
         "--chat-model",
         default="gpt-4o-mini",
-        help="OpenAI chat model for cluster descriptions.",
+        help="OpenAI chat model for cluster descriptions ('none' skips the LLM and keeps "
+        "generic cluster names, e.g. for offline runs).",
+    )
+    parser.add_argument(
+        "--label-concurrency",
+        type=int,
+        default=8,
+        help="Number of clusters labelled by the chat model at the same time.",
+    )
+    parser.add_argument(
+        "--label-timeout",
+        type=float,
+        default=60.0,
+        help="Timeout in seconds for a single labelling request.",
+    )
+    parser.add_argument(
+        "--label-retries",
+        type=int,
+        default=3,
+        help="Retries (with jittered backoff) per cluster before giving up on its label.",
+    )
+    parser.add_argument(
+        "--label-cache",
+        type=Path,
+        default=None,
+        help="JSON cache of cluster labels keyed by chat model, prompt and example set "
+        "(default: labels.json inside --cache when that is given).",
+    )
+
+    # Embedding throughput
+    parser.add_argument(
+        "--embedding-mode",
+        choices=["async", "sequential"],
+        default="async",
+        help="Send embedding batches concurrently (async) or one after another (sequential).",
+    )
+    parser.add_argument(
+        "--embedding-concurrency",
+        type=int,
+        default=8,
+        help="Maximum number of embedding requests in flight (async mode only).",
+    )
+    parser.add_argument(
+        "--embedding-rpm",
+        type=int,
+        default=None,
+        help="Requests‑per‑minute budget for the embedding API (async mode only).",
+    )
+    parser.add_argument(
+        "--embedding-tpm",
+        type=int,
+        default=None,
+        help="Tokens‑per‑minute budget for the embedding API (async mode only).",
+    )
+    parser.add_argument(
+        "--batch-max-tokens",
+        type=int,
+        default=50_000,
+        help="Upper bound on the estimated number of tokens per embedding request.",
+    )
+    parser.add_argument(
+        "--batch-max-items",
+        type=int,
+        default=512,
+        help="Upper bound on the number of texts per embedding request.",
     )
 
     # Clustering parameters
     parser.add_argument(
         "--cluster-method",
-        choices=["kmeans", "dbscan"],
+        choices=["kmeans", "minibatch-kmeans", "dbscan"],
         default="kmeans",
         help="Clustering algorithm to use.",
     )
@@ -74,7 +218,44 @@ def parse_cli() -> argparse.Namespace:  # noqa: D401
         "--k-max",
         type=int,
         default=10,
-        help="Upper bound for k when the kmeans method is selected.",
+        help="Upper bound for k when a kmeans method is selected.",
+    )
+    parser.add_argument(
+        "--k-sample-size",
+        type=int,
+        default=20_000,
+        help="Rows sampled to select k (minibatch-kmeans only).",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=8192,
+        help="Rows per streamed mini‑batch (minibatch-kmeans only).",
+    )
+    parser.add_argument(
+        "--k-criterion",
+        choices=K_CRITERIA,
+        default="silhouette",
+        help="Score used to pick k: silhouette (sampled), a centroid‑based simplified "
+        "silhouette, or the cheaper Calinski‑Harabasz / Davies‑Bouldin indices.",
+    )
+    parser.add_argument(
+        "--silhouette-sample",
+        type=int,
+        default=10_000,
+        help="Stratified sample size for the silhouette criterion (0 = use every row).",
+    )
+    parser.add_argument(
+        "--k-jobs",
+        type=int,
+        default=1,
+        help="Worker processes for the kmeans k sweep (0 = one per CPU).",
+    )
+    parser.add_argument(
+        "--k-patience",
+        type=int,
+        default=0,
+        help="Stop the kmeans k sweep after this many k values without improvement (0 = off).",
     )
     parser.add_argument(
         "--dbscan-min-samples",
@@ -82,6 +263,25 @@ def parse_cli() -> argparse.Namespace:  # noqa: D401
         default=3,
         help="min_samples parameter for DBSCAN (only relevant when dbscan is selected).",
     )
+    parser.add_argument(
+        "--dbscan-index",
+        choices=["auto", "exact", "ivf"],
+        default="auto",
+        help="Neighbour search for DBSCAN: exact, an approximate IVF index, or auto "
+        f"(IVF from {ANN_MIN_ROWS} prompts on). The IVF index is stored next to --cache.",
+    )
+    parser.add_argument(
+        "--ann-nprobe",
+        type=int,
+        default=8,
+        help="Number of IVF cells probed per query (higher = more exact, slower).",
+    )
+    parser.add_argument(
+        "--dbscan-check",
+        action="store_true",
+        help="With the IVF index, also run exact DBSCAN at the same eps and report the "
+        "agreement (adjusted Rand index). Slow – for tuning --ann-nprobe.",
+    )
 
     # Output paths
     parser.add_argument(
@@ -90,213 +290,2432 @@ def parse_cli() -> argparse.Namespace:  # noqa: D401
     parser.add_argument(
         "--plots-dir", type=Path, default=Path("plots"), help="Directory that will hold PNG plots."
     )
+    parser.add_argument(
+        "--projection",
+        choices=PROJECTIONS,
+        default="auto",
+        help="2‑D projection for the scatter plot: pca (instant), umap (approximate), "
+        "tsne (every row) or tsne-sample (stratified sample + out‑of‑sample placement). "
+        f"auto = tsne up to {TSNE_MAX_ROWS} prompts, tsne-sample above.",
+    )
+    parser.add_argument(
+        "--projection-sample",
+        type=int,
+        default=10_000,
+        help="Rows embedded by t‑SNE with --projection tsne-sample.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        nargs="?",
+        const=Path("profile_trace.json"),
+        default=None,
+        help="Write a per‑stage Chrome trace (wall / CPU time, memory peak, API requests, "
+        "tokens, cache hits) to this path (default: profile_trace.json) and add a "
+        "profile table to the report.",
+    )
+    parser.add_argument(
+        "--stats-json",
+        type=Path,
+        default=Path("cluster_stats.json"),
+        help="Per‑cluster statistics (sizes, spread, nearest cluster) as JSON for dashboards.",
+    )
+
+    # Incremental runs
+    parser.add_argument(
+        "--state",
+        type=Path,
+        default=Path("cluster_state.npz"),
+        help="Centroids, names and assigned prompts saved by every run for --update.",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Assign the input to the clusters in --state instead of re‑clustering.",
+    )
+    parser.add_argument(
+        "--update-threshold",
+        type=float,
+        default=2.0,
+        help="With --update, a prompt farther than this × the cluster's spread from every "
+        "centroid starts a new cluster.",
+    )
+    parser.add_argument(
+        "--update-min-size",
+        type=int,
+        default=3,
+        help="With --update, smallest new cluster (in prompts); smaller groups are noise.",
+    )
+    parser.add_argument(
+        "--update-relabel-fraction",
+        type=float,
+        default=0.25,
+        help="With --update, rename a grown cluster only once its new prompts weigh at least "
+        "this fraction of its previous size; smaller additions keep the existing name.",
+    )
 
     return parser.parse_args()
 
 
+# ---------------------------------------------------------------------------
+# Profiling
+# ---------------------------------------------------------------------------
+
+
+_current_stage: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "cluster_prompts_stage", default=None
+)
+
+
+def _peak_rss_mb() -> float | None:
+    """Peak resident set size of this process so far (``None`` on Windows)."""
+
+    try:
+        import resource
+    except ImportError:  # pragma: no cover – Windows.
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere.
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+class Profiler:
+    """Per‑stage wall time, CPU time, memory high‑water mark and counters.
+
+    :meth:`stage` spans may nest and run on several threads; every span
+    becomes a Chrome trace "complete" event (open :meth:`write_trace`'s output
+    in ``chrome://tracing`` or Perfetto).  :meth:`count` adds to a counter
+    (API requests, tokens, cache hits …) of the innermost stage active in the
+    calling context.  Recording is cheap, so it is always on; ``--profile``
+    only decides whether the trace and the summary table are written.
+
+    Memory comes from ``ru_maxrss``, the process‑lifetime peak: each span
+    records that peak at its end (``peak_rss_mb``) and how far the span raised
+    it (``rss_growth_mb``).  A stage that stays below an earlier peak shows no
+    growth; concurrent stages share whatever growth happened while they ran.
+    """
+
+    def __init__(self):
+        self.events: list[dict[str, Any]] = []
+        self.counters: dict[str, dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, cpu_clock: Callable[[], float] = time.process_time):
+        """Record the block as stage *name*.
+
+        *cpu_clock* defaults to the process CPU time – right for stages that
+        run alone (and use several BLAS threads); concurrent stages pass
+        :func:`time.thread_time`.
+        """
+
+        token = _current_stage.set(name)
+        start, cpu, rss = time.time(), cpu_clock(), _peak_rss_mb()
+        try:
+            yield
+        finally:
+            _current_stage.reset(token)
+            peak = _peak_rss_mb()
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": (time.time() - start) * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": {
+                    "cpu_s": cpu_clock() - cpu,
+                    "peak_rss_mb": peak,
+                    "rss_growth_mb": None if peak is None else peak - rss,
+                },
+            }
+            with self._lock:
+                self.events.append(event)
+
+    def call(self, name: str, fn: Callable[..., Any], *args, cpu_clock=time.process_time):
+        with self.stage(name, cpu_clock):
+            return fn(*args)
+
+    def count(self, counter: str, value: float = 1) -> None:
+        stage = _current_stage.get() or "(no stage)"
+        with self._lock:
+            counters = self.counters.setdefault(stage, {})
+            counters[counter] = counters.get(counter, 0) + value
+
+    def merge(self, events: list[dict[str, Any]], counters: dict[str, dict[str, float]]) -> None:
+        """Add spans and counters recorded by another process."""
+
+        with self._lock:
+            self.events.extend(events)
+            for stage, values in counters.items():
+                mine = self.counters.setdefault(stage, {})
+                for counter, value in values.items():
+                    mine[counter] = mine.get(counter, 0) + value
+
+    def summary(self) -> list[dict[str, Any]]:
+        """One row per stage name (first‑seen order): totals over all its spans."""
+
+        rows: dict[str, dict[str, Any]] = {}
+        for event in sorted(self.events, key=lambda e: e["ts"]):
+            row = rows.setdefault(
+                event["name"], {"stage": event["name"], "calls": 0, "wall_s": 0.0, "cpu_s": 0.0}
+            )
+            row["calls"] += 1
+            row["wall_s"] += event["dur"] / 1e6
+            row["cpu_s"] += event["args"]["cpu_s"]
+            rss = event["args"]["peak_rss_mb"]
+            if rss is not None:
+                row["peak_rss_mb"] = max(row.get("peak_rss_mb", 0.0), rss)
+                growth = event["args"]["rss_growth_mb"]
+                row["rss_growth_mb"] = max(row.get("rss_growth_mb", 0.0), growth)
+        for name, counters in self.counters.items():
+            row = rows.setdefault(name, {"stage": name, "calls": 0, "wall_s": 0.0, "cpu_s": 0.0})
+            row["counters"] = dict(counters)
+        return list(rows.values())
+
+    def write_trace(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        trace = {
+            "traceEvents": sorted(self.events, key=lambda e: e["ts"]),
+            "displayTimeUnit": "ms",
+            "otherData": {"counters": self.counters},
+        }
+        path.write_text(json.dumps(trace, indent=1), encoding="utf-8")
+        print(f"Wrote profile trace to {path}")
+
+
+PROFILER = Profiler()
+
+
+def _profiled_call(name: str, fn: Callable[..., Any], *args):
+    """Process‑pool wrapper: run *fn* as a stage and ship the profile back."""
+
+    result = PROFILER.call(name, fn, *args)
+    # A pool worker may run several stages – ship each span only once.
+    events, counters = PROFILER.events, PROFILER.counters
+    PROFILER.events, PROFILER.counters = [], {}
+    return result, events, counters
+
+
+def _usage_tokens(response, fallback: int) -> int:
+    """Tokens billed for *response*, or *fallback* when the API omits ``usage``."""
+
+    usage = getattr(response, "usage", None)
+    return int(getattr(usage, "total_tokens", None) or fallback)
+
+
+# ---------------------------------------------------------------------------
+# Input loading
+# ---------------------------------------------------------------------------
+
+
+INPUT_COLUMNS = ("act", "prompt", "for_devs")
+
+
+def _iter_input_chunks(path: Path, chunk_rows: int):
+    """Yield DataFrame chunks of *path* (CSV, JSONL or Parquet) by extension."""
+
+    suffixes = [s.lower() for s in path.suffixes]
+    if ".parquet" in suffixes or ".pq" in suffixes:
+        try:
+            import pyarrow.parquet as pq  # type: ignore
+        except ImportError as exc:  # pragma: no cover
+            raise SystemExit("Reading Parquet requires `pyarrow` – pip install pyarrow") from exc
+
+        parquet = pq.ParquetFile(path)
+        columns = [c for c in INPUT_COLUMNS if c in parquet.schema_arrow.names]
+        for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+    elif ".jsonl" in suffixes or ".ndjson" in suffixes:
+        yield from pd.read_json(path, lines=True, chunksize=chunk_rows, dtype=False)
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows, usecols=lambda c: c in INPUT_COLUMNS)
+
+
+def _content_key(text: str) -> bytes:
+    return hashlib.blake2b(_normalise_text(text).encode("utf-8"), digest_size=16).digest()
+
+
+def read_prompts(path: Path, chunk_rows: int = 100_000) -> pd.DataFrame:
+    """Stream *path* and return one row per distinct prompt.
+
+    The file is read *chunk_rows* rows at a time, so only the distinct prompts
+    are ever held in memory.  Prompts are deduplicated by a hash of their
+    normalised text (see :func:`_normalise_text`); the first occurrence keeps
+    its ``act`` / ``for_devs`` columns and a ``count`` column records how often
+    the prompt appeared.  Empty prompts are dropped.
+    """
+
+    seen: dict[bytes, int] = {}
+    counts: list[int] = []
+    parts: list[pd.DataFrame] = []
+    n_rows = 0
+
+    for chunk in _iter_input_chunks(path, chunk_rows):
+        if "prompt" not in chunk.columns:
+            raise SystemExit(f"Input {path} must contain a 'prompt' column.")
+        chunk = chunk[[c for c in INPUT_COLUMNS if c in chunk.columns]]
+        chunk = chunk[chunk["prompt"].notna() & (chunk["prompt"].astype(str).str.strip() != "")]
+        n_rows += len(chunk)
+
+        codes, keys = pd.factorize(chunk["prompt"].astype(str).map(_content_key))
+        _, first = np.unique(codes, return_index=True)
+        new_rows = []
+        for key, n, row in zip(keys, np.bincount(codes), first):
+            pos = seen.get(key)
+            if pos is None:
+                seen[key] = len(counts)
+                counts.append(int(n))
+                new_rows.append(row)
+            else:
+                counts[pos] += int(n)
+        if new_rows:
+            parts.append(chunk.iloc[np.sort(new_rows)])
+
+    if not parts:
+        raise SystemExit(f"No prompts found in {path}.")
+    df = pd.concat(parts, ignore_index=True)
+    df["count"] = np.asarray(counts, dtype=np.int64)
+    print(f"Read {n_rows} prompt(s), {len(df)} distinct, from {path}.", flush=True)
+    return df
+
+
 # ---------------------------------------------------------------------------
 # Embedding helpers
 # ---------------------------------------------------------------------------
 
 
-def _lazy_import_openai():  # noqa: D401
-    """Import *openai* only when needed to keep startup lightweight."""
+def _lazy_import_openai():  # noqa: D401
+    """Import *openai* only when needed to keep startup lightweight."""
+
+    try:
+        import openai  # type: ignore
+
+        return openai
+    except ImportError as exc:  # pragma: no cover – we do not test missing deps.
+        raise SystemExit(
+            "The 'openai' package is required but not installed.\n"
+            "Run 'pip install openai' and try again."
+        ) from exc
+
+
+def _estimate_tokens(text: str) -> int:
+    """Cheap, deliberately conservative token estimate for *text*.
+
+    English averages ~4 characters per token; counting UTF‑8 *bytes* and
+    dividing by 3 over‑estimates slightly and stays safe for code and
+    non‑Latin scripts, where tokens are shorter.
+    """
+
+    return len(text.encode("utf-8")) // 3 + 1
+
+
+# Fixed batch size used before token‑aware planning – kept for the savings report.
+LEGACY_BATCH_SIZE = 100
+
+
+def plan_batches(
+    texts: Sequence[str], *, max_tokens: int, max_items: int
+) -> list[tuple[int, int]]:
+    """Pack *texts* into contiguous ``(start, stop)`` batches.
+
+    A batch is closed as soon as adding the next text would exceed either
+    *max_tokens* (estimated via :func:`_estimate_tokens`) or *max_items*.  A
+    single text larger than *max_tokens* gets a batch of its own.  Because
+    batches are contiguous, concatenating their results preserves input order.
+    """
+
+    batches: list[tuple[int, int]] = []
+    start = 0
+    tokens = 0
+    for i, text in enumerate(texts):
+        n = _estimate_tokens(text)
+        if i > start and (tokens + n > max_tokens or i - start >= max_items):
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += n
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+# Called with ``(texts, vectors)`` whenever an embedding batch completes.
+BatchCallback = Callable[[Sequence[str], list[list[float]]], None]
+
+
+class _RateLimiter:
+    """Token buckets for a requests‑per‑minute and a tokens‑per‑minute budget.
+
+    Either budget may be ``None`` (unlimited).  :meth:`pause` blocks every
+    caller until the given delay has elapsed, which is how a 429 from one
+    request throttles all the others.
+    """
+
+    def __init__(self, rpm: int | None, tpm: int | None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm or 0)
+        self._tokens = float(tpm or 0)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._last
+        self._last = now
+        if self.rpm:
+            self._requests = min(float(self.rpm), self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(float(self.tpm), self._tokens + elapsed * self.tpm / 60)
+
+    def pause(self, delay: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    async def acquire(self, tokens: int) -> None:
+        # A single request larger than the whole budget would wait forever.
+        if self.tpm:
+            tokens = min(tokens, self.tpm)
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._refill(now)
+                wait = 0.0
+                if self.rpm and self._requests < 1:
+                    wait = max(wait, (1 - self._requests) * 60 / self.rpm)
+                if self.tpm and self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+                if wait <= 0:
+                    if self.rpm:
+                        self._requests -= 1
+                    if self.tpm:
+                        self._tokens -= tokens
+                    return
+                await asyncio.sleep(wait)
+
+
+class AsyncEmbeddingEngine:
+    """Embed batches concurrently while respecting the account rate limits.
+
+    * At most *max_in_flight* requests are outstanding at any time.
+    * Requests are admitted through :class:`_RateLimiter` so the RPM / TPM
+      budgets are never exceeded on our side.
+    * A 429 pauses *all* requests (honouring ``Retry-After`` when present) and
+      doubles the shared backoff; every success halves it again.
+    * Results are written into per‑batch slots so the output order always
+      matches the input order, regardless of completion order.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        *,
+        dimensions: int | None = None,
+        max_in_flight: int = 8,
+        rpm: int | None = None,
+        tpm: int | None = None,
+        max_retries: int = 8,
+    ):
+        self.model = model
+        self.dimensions = dimensions
+        self.max_in_flight = max(1, max_in_flight)
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self._backoff = 1.0
+
+    def embed(
+        self, batches: Sequence[Sequence[str]], on_batch: BatchCallback | None = None
+    ) -> list[list[float]] | None:
+        """Embed every batch and return the vectors flattened in input order.
+
+        With *on_batch* – called (on the event loop thread) as each batch
+        finishes – the vectors are handed over and not kept, and ``None`` is
+        returned.
+        """
+
+        results = asyncio.run(self._embed_all(batches, on_batch))
+        if on_batch is not None:
+            return None
+        return [vec for batch in results for vec in batch]
+
+    async def _embed_all(
+        self, batches: Sequence[Sequence[str]], on_batch: BatchCallback | None
+    ) -> list[list[list[float]]]:
+        openai = _lazy_import_openai()
+        # Retries and back‑off are ours (below); the SDK's would multiply them.
+        client = openai.AsyncOpenAI(max_retries=0)
+        limiter = _RateLimiter(self.rpm, self.tpm)
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        results: list[list[list[float]]] = [[] for _ in batches]
+
+        async def run(idx: int, batch: Sequence[str]) -> None:
+            async with semaphore:
+                vectors = await self._embed_batch(openai, client, limiter, batch)
+            if on_batch is not None:
+                on_batch(batch, vectors)
+            else:
+                results[idx] = vectors
+
+        try:
+            await asyncio.gather(*(run(i, b) for i, b in enumerate(batches)))
+        finally:
+            await client.close()
+        return results
+
+    async def _embed_batch(self, openai, client, limiter: _RateLimiter, batch: Sequence[str]):
+        tokens = sum(_estimate_tokens(t) for t in batch)
+        extra = {"dimensions": self.dimensions} if self.dimensions else {}
+
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire(tokens)
+            try:
+                response = await client.embeddings.create(
+                    input=list(batch), model=self.model, **extra
+                )
+            except openai.RateLimitError as exc:
+                PROFILER.count("embedding_retries")
+                if attempt == self.max_retries:
+                    raise
+                delay = _retry_after(exc) or self._backoff * (1 + random.random())
+                self._backoff = min(self._backoff * 2, 60.0)
+                limiter.pause(delay)
+                print(f"⚠️  Rate limited – backing off {delay:.1f}s.", file=sys.stderr, flush=True)
+                continue
+            except (openai.APIConnectionError, openai.InternalServerError):
+                PROFILER.count("embedding_retries")
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(min(2**attempt, 30) * (1 + random.random()))
+                continue
+
+            self._backoff = max(self._backoff / 2, 1.0)
+            PROFILER.count("embedding_requests")
+            PROFILER.count("embedding_tokens", _usage_tokens(response, tokens))
+            return [data.embedding for data in response.data]
+
+        raise AssertionError("unreachable")  # pragma: no cover
+
+
+def _retry_after(exc: Exception) -> float | None:
+    """Return the ``Retry-After`` delay (seconds) carried by an API error."""
+
+    response = getattr(exc, "response", None)
+    value = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def embed_texts(
+    texts: Sequence[str],
+    model: str,
+    *,
+    max_batch_tokens: int = 50_000,
+    max_batch_items: int = 512,
+    dimensions: int | None = None,
+    mode: str = "async",
+    max_in_flight: int = 8,
+    rpm: int | None = None,
+    tpm: int | None = None,
+    on_batch: BatchCallback | None = None,
+) -> list[list[float]] | None:
+    """Embed *texts* with OpenAI and return a list of vectors.
+
+    Texts are grouped by :func:`plan_batches` so every request stays below
+    *max_batch_tokens* / *max_batch_items*.  With ``mode="async"`` (default)
+    batches are sent concurrently through :class:`AsyncEmbeddingEngine`;
+    ``mode="sequential"`` keeps the simple one‑request‑at‑a‑time loop around
+    for comparison and debugging.  *dimensions* requests shortened vectors
+    (``text-embedding-3-*`` only).  *on_batch* is invoked with every batch and
+    its vectors as soon as that batch completes; the vectors are then not
+    kept and ``None`` is returned, so a large job is never held in memory.
+    """
+
+    spans = plan_batches(texts, max_tokens=max_batch_tokens, max_items=max_batch_items)
+    batches = [list(texts[a:b]) for a, b in spans]
+
+    legacy = -(-len(texts) // LEGACY_BATCH_SIZE)
+    print(
+        f"Planned {len(batches)} embedding request(s) for {len(texts)} text(s) "
+        f"({legacy - len(batches):+d} saved vs. fixed batches of {LEGACY_BATCH_SIZE}).",
+        flush=True,
+    )
+
+    if mode == "async":
+        engine = AsyncEmbeddingEngine(
+            model, dimensions=dimensions, max_in_flight=max_in_flight, rpm=rpm, tpm=tpm
+        )
+        return engine.embed(batches, on_batch=on_batch)
+
+    openai = _lazy_import_openai()
+    client = openai.OpenAI()
+
+    embeddings: list[list[float]] = []
+
+    extra = {"dimensions": dimensions} if dimensions else {}
+
+    for batch in batches:
+        response = client.embeddings.create(input=batch, model=model, **extra)
+        PROFILER.count("embedding_requests")
+        PROFILER.count(
+            "embedding_tokens", _usage_tokens(response, sum(_estimate_tokens(t) for t in batch))
+        )
+        # The API returns the vectors in the same order as the input list.
+        vectors = [data.embedding for data in response.data]
+        if on_batch is not None:
+            on_batch(batch, vectors)
+        else:
+            embeddings.extend(vectors)
+
+    return None if on_batch is not None else embeddings
+
+
+def _normalise_text(text: str) -> str:
+    """Canonical form used for cache keys (NFC, trimmed, single spaces)."""
+
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_namespace(model: str, dimensions: int | None) -> str:
+    """Return the cache namespace for vectors produced by *model*."""
+
+    return f"{model}@{dimensions or 'native'}"
+
+
+def _text_key(text: str, namespace: str) -> bytes:
+    """Return the fixed‑width cache key for *text* within *namespace*."""
+
+    payload = f"{namespace}\0{_normalise_text(text)}".encode("utf-8")
+    return hashlib.blake2b(payload, digest_size=EmbeddingStore.KEY_BYTES).digest()
+
+
+class EmbeddingStore:
+    """Append‑only embedding cache backed by a memory‑mapped float32 matrix.
+
+    A store holds the vectors of exactly one namespace (embedding model plus
+    output dimensions, see :func:`cache_namespace`) and is a directory with
+    these files:
+
+    * ``vectors.f32`` – raw row‑major float32 matrix, one row per cached text.
+    * ``keys.bin`` – fixed‑width digests; the *i*‑th digest belongs to row *i*.
+    * ``atime.u32`` – last access (epoch seconds) of every row, for eviction.
+    * ``meta.json`` – tiny header holding the namespace and vector dimension.
+    * ``journal.bin`` – only while embedding: ``key + vector`` records written
+      after every completed batch (see :meth:`checkpoint`).
+
+    Opening the store only reads the key file, the vectors are memory‑mapped
+    and just the requested rows are ever paged in.  New vectors are appended to
+    the end of both files – existing rows are only rewritten by :meth:`retain`
+    during eviction.  A journal left behind by an interrupted run is compacted
+    into the store on open.
+    """
+
+    KEY_BYTES = 16
+    COPY_ROWS = 65_536  # rows per block when copying vectors out of the memory map
+
+    def __init__(self, root: Path, *, namespace: str = "", fsync_every: int = 8):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = root / "vectors.f32"
+        self._keys_path = root / "keys.bin"
+        self._atime_path = root / "atime.u32"
+        self._meta_path = root / "meta.json"
+        self._journal_path = root / "journal.bin"
+
+        self.namespace = namespace
+        self.dim: int | None = None
+        if self._meta_path.exists():
+            meta = json.loads(self._meta_path.read_text())
+            self.dim = int(meta["dim"])
+            self.namespace = meta.get("namespace", namespace)
+
+        self.fsync_every = max(1, fsync_every)
+        self._journal = None
+        self._unsynced = 0
+
+        self._index: dict[bytes, int] = {}
+        self._matrix: np.ndarray | None = None
+        self._atime: np.ndarray | None = None
+        self._load()
+
+        if self._journal_path.exists():
+            recovered = self.compact()
+            if recovered:
+                print(f"Recovered {recovered} embedding(s) from an interrupted run.", flush=True)
+
+    # -- internal helpers -------------------------------------------------
+
+    def _load(self) -> None:
+        raw = self._keys_path.read_bytes() if self._keys_path.exists() else b""
+        n_keys = len(raw) // self.KEY_BYTES
+
+        n_rows = 0
+        if self.dim and self._vectors_path.exists():
+            n_rows = self._vectors_path.stat().st_size // (4 * self.dim)
+
+        # A crash between the two appends leaves the files with different
+        # lengths – only rows present in both are considered valid.
+        n = min(n_keys, n_rows)
+        kb = self.KEY_BYTES
+        self._index = {raw[i * kb : (i + 1) * kb]: i for i in range(n)}
+        self._matrix = None
+        self._atime = None
+        if not n:
+            return
+
+        self._matrix = np.memmap(
+            self._vectors_path, dtype=np.float32, mode="r", shape=(n, self.dim)
+        )
+
+        # Access times are advisory: pad a short file with "now" instead of failing.
+        n_atime = self._atime_path.stat().st_size // 4 if self._atime_path.exists() else 0
+        if n_atime < n:
+            with self._atime_path.open("ab") as fh:
+                fh.write(np.full(n - n_atime, int(time.time()), dtype=np.uint32).tobytes())
+        self._atime = np.memmap(self._atime_path, dtype=np.uint32, mode="r+", shape=(n,))
+
+    # -- public API -------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the vector matrix on disk."""
+
+        return len(self) * 4 * (self.dim or 0)
+
+    @property
+    def last_access(self) -> np.ndarray:
+        """Per‑row last access time (epoch seconds)."""
+
+        return np.asarray(self._atime) if self._atime is not None else np.empty(0, np.uint32)
+
+    def key(self, text: str) -> bytes:
+        """Return the cache key of *text* in this store's namespace."""
+
+        return _text_key(text, self.namespace)
+
+    def lookup(self, keys: Sequence[bytes]) -> np.ndarray:
+        """Return the row for every key in *keys* (``-1`` when missing).
+
+        Rows that are found have their last‑access time refreshed.
+        """
+
+        get = self._index.get
+        rows = np.fromiter((get(k, -1) for k in keys), dtype=np.int64, count=len(keys))
+        if self._atime is not None:
+            hits = rows[rows >= 0]
+            if hits.size:
+                self._atime[hits] = int(time.time())
+                self._atime.flush()
+        return rows
+
+    def take(self, rows: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+        """Copy the given *rows* out of the memory map into a dense matrix.
+
+        With *out* (e.g. a writable :class:`numpy.memmap`) the rows are copied
+        into it block by block and *out* is returned.
+        """
+
+        if self._matrix is None:
+            raise KeyError("Embedding store is empty.")
+        if out is None:
+            return np.asarray(self._matrix[rows], dtype=np.float32)
+        for start in range(0, len(rows), self.COPY_ROWS):
+            block = rows[start : start + self.COPY_ROWS]
+            out[start : start + len(block)] = self._matrix[block]
+        return out
+
+    def append(self, keys: Sequence[bytes], vectors: Sequence[Sequence[float]]) -> None:
+        """Append *vectors* under *keys*; keys already present are skipped."""
+
+        fresh: dict[bytes, Sequence[float]] = {}
+        for key, vec in zip(keys, vectors):
+            if key not in self._index:
+                fresh[key] = vec
+        if not fresh:
+            return
+
+        mat = self._as_matrix(list(fresh.values()))
+        atime = np.full(len(fresh), int(time.time()), dtype=np.uint32)
+
+        # Vectors first, keys second: a torn write leaves an orphaned row that
+        # ``_load`` ignores rather than a key pointing at garbage.
+        payloads = (
+            (self._vectors_path, mat.tobytes()),
+            (self._atime_path, atime.tobytes()),
+            (self._keys_path, b"".join(fresh)),
+        )
+        for path, payload in payloads:
+            with path.open("ab") as fh:
+                fh.write(payload)
+                fh.flush()
+                os.fsync(fh.fileno())
+
+        self._load()
+
+    def retain(self, keep: np.ndarray) -> int:
+        """Rewrite the store keeping only rows where *keep* is true.
+
+        The new files are written next to the old ones and swapped in with
+        :func:`os.replace`, so a crash leaves either the old or the new store.
+        Vectors are copied *COPY_ROWS* at a time, so the store is never loaded
+        whole.  Returns the number of rows dropped.
+        """
+
+        dropped = int((~keep).sum())
+        if not dropped:
+            return 0
+
+        raw = self._keys_path.read_bytes()
+        keys = np.frombuffer(raw[: len(self) * self.KEY_BYTES], dtype=f"V{self.KEY_BYTES}")
+        tmp_vectors = self._vectors_path.with_suffix(self._vectors_path.suffix + ".tmp")
+        with tmp_vectors.open("wb") as fh:
+            for start in range(0, len(keep), self.COPY_ROWS):
+                block = keep[start : start + self.COPY_ROWS]
+                fh.write(self._matrix[start : start + len(block)][block].tobytes())
+        payloads = (
+            (self._atime_path, self.last_access[keep].tobytes()),
+            (self._keys_path, keys[keep].tobytes()),
+        )
+        self._matrix = self._atime = None  # release the memory maps before replacing
+        os.replace(tmp_vectors, self._vectors_path)
+        for path, payload in payloads:
+            tmp = path.with_suffix(path.suffix + ".tmp")
+            tmp.write_bytes(payload)
+            os.replace(tmp, path)
+
+        self._load()
+        return dropped
+
+    def checkpoint(self, keys: Sequence[bytes], vectors: Sequence[Sequence[float]]) -> None:
+        """Journal one completed batch so it survives a crash or Ctrl‑C.
+
+        Records are appended to ``journal.bin`` and fsync'ed every
+        *fsync_every* batches; :meth:`compact` later folds them into the store.
+        """
+
+        mat = self._as_matrix(vectors)
+        if self._journal is None:
+            self._journal = self._journal_path.open("ab")
+
+        record = np.empty(
+            len(keys), dtype=[("key", f"V{self.KEY_BYTES}"), ("vec", np.float32, (self.dim,))]
+        )
+        record["key"] = np.frombuffer(b"".join(keys), dtype=f"V{self.KEY_BYTES}")
+        record["vec"] = mat
+        self._journal.write(record.tobytes())
+
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self._sync_journal()
+
+    def compact(self) -> int:
+        """Fold the journal into the main files and delete it; return #rows added."""
+
+        if self._journal is not None:
+            self._sync_journal()
+            self._journal.close()
+            self._journal = None
+
+        if not self._journal_path.exists():
+            return 0
+
+        before = len(self)
+        if self.dim:
+            dtype = np.dtype([("key", f"V{self.KEY_BYTES}"), ("vec", np.float32, (self.dim,))])
+            raw = self._journal_path.read_bytes()
+            # Drop a torn trailing record from a crash mid‑write.
+            records = np.frombuffer(raw[: len(raw) - len(raw) % dtype.itemsize], dtype=dtype)
+            self.append([bytes(k) for k in records["key"]], records["vec"])
+
+        # Only delete the journal once its rows are durable in the store.
+        self._journal_path.unlink()
+        return len(self) - before
+
+    def _sync_journal(self) -> None:
+        if self._journal is not None and self._unsynced:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._unsynced = 0
+
+    def _as_matrix(self, vectors: Sequence[Sequence[float]]) -> np.ndarray:
+        mat = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = int(mat.shape[1])
+            self._meta_path.write_text(json.dumps({"namespace": self.namespace, "dim": self.dim}))
+        elif mat.shape[1] != self.dim:
+            raise ValueError(
+                f"Embedding dimension mismatch: store has {self.dim}, got {mat.shape[1]}."
+            )
+        return mat
+
+    def import_json(self, json_path: Path) -> int:
+        """Import a legacy ``{text: vector}`` JSON cache; return #rows added."""
+
+        try:
+            legacy: dict[str, list[float]] = json.loads(json_path.read_text())
+        except json.JSONDecodeError:  # pragma: no cover – unlikely.
+            print("⚠️  Cache file exists but is not valid JSON – ignoring.", file=sys.stderr)
+            return 0
+
+        before = len(self)
+        self.append([self.key(t) for t in legacy], list(legacy.values()))
+        return len(self) - before
+
+
+class EmbeddingCache:
+    """A shared cache directory with one :class:`EmbeddingStore` per namespace.
+
+    Vectors from different embedding models (or output dimensions) never
+    collide because each namespace lives in its own sub‑directory and is part
+    of every key.  :meth:`evict` enforces a global size cap and a maximum age
+    across all namespaces, dropping the least recently used rows first.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _dirname(namespace: str) -> str:
+        return re.sub(r"[^A-Za-z0-9._-]", "_", namespace)
+
+    def store(self, namespace: str) -> EmbeddingStore:
+        return EmbeddingStore(self.root / self._dirname(namespace), namespace=namespace)
+
+    def stores(self) -> list[EmbeddingStore]:
+        paths = sorted(self.root.iterdir())
+        return [EmbeddingStore(p) for p in paths if (p / "meta.json").exists()]
+
+    def evict(self, *, max_bytes: int | None = None, max_age_days: float | None = None) -> int:
+        """Drop expired and least recently used rows; return #rows evicted."""
+
+        stores = self.stores()
+        if not stores:
+            return 0
+
+        atimes = [s.last_access for s in stores]
+        keep = [np.ones(len(a), dtype=bool) for a in atimes]
+
+        if max_age_days is not None:
+            cutoff = time.time() - max_age_days * 86_400
+            keep = [k & (a >= cutoff) for k, a in zip(keep, atimes)]
+
+        if max_bytes is not None:
+            row_bytes = np.concatenate(
+                [np.full(len(a), 4 * (s.dim or 0), dtype=np.int64) for s, a in zip(stores, atimes)]
+            )
+            flat_keep = np.concatenate(keep)
+            flat_atime = np.concatenate(atimes)
+            excess = int(row_bytes[flat_keep].sum()) - max_bytes
+            if excess > 0:
+                # Oldest surviving rows first, until we are back under the cap.
+                order = np.argsort(flat_atime, kind="stable")
+                order = order[flat_keep[order]]
+                cut = int(np.searchsorted(np.cumsum(row_bytes[order]), excess)) + 1
+                flat_keep[order[:cut]] = False
+                keep = np.split(flat_keep, np.cumsum([len(a) for a in atimes])[:-1])
+
+        return sum(s.retain(k) for s, k in zip(stores, keep))
+
+
+def cache_root(cache_path: Path) -> Path:
+    """Directory of the binary cache behind ``--cache`` (see :func:`open_embedding_store`)."""
+
+    return cache_path.with_suffix(".emb") if cache_path.suffix == ".json" else cache_path
+
+
+def open_embedding_store(
+    cache_path: Path, namespace: str, legacy_model: str = "text-embedding-3-small"
+) -> tuple[EmbeddingCache, EmbeddingStore]:
+    """Open the cache behind ``--cache`` and the store for *namespace*.
+
+    A path ending in ``.json`` is treated as a legacy cache: the binary cache
+    lives next to it (same name, ``.emb`` suffix) and the JSON vectors are
+    imported the first time the namespace of *legacy_model* (the OpenAI model
+    that wrote them, at native dimensions) is opened.  Other namespaces never
+    see them.  Any other path is the cache directory itself.
+    """
+
+    cache = EmbeddingCache(cache_root(cache_path))
+    store = cache.store(namespace)
+    if cache_path.suffix == ".json" and cache_path.exists() and len(store) == 0:
+        if namespace == cache_namespace(legacy_model, None):
+            added = store.import_json(cache_path)
+            print(f"Imported {added} embedding(s) from legacy cache {cache_path}.", flush=True)
+        else:
+            print(
+                f"⚠️  Legacy cache {cache_path} holds {legacy_model} vectors; not importing "
+                f"them into {namespace} (see --legacy-cache-model).",
+                file=sys.stderr,
+            )
+    return cache, store
+
+
+def load_or_create_embeddings(
+    prompts: pd.Series,
+    *,
+    cache_path: Path | None,
+    backend: EmbeddingBackend,
+    cache_max_mb: float | None = None,
+    cache_max_age_days: float | None = None,
+    legacy_model: str = "text-embedding-3-small",
+    spill: IO[bytes] | None = None,
+) -> pd.DataFrame:
+    """Return a *DataFrame* with one row per prompt and the embedding columns.
+
+    * If *cache_path* is provided, known embeddings are read from the binary
+      :class:`EmbeddingCache` so they don't have to be re‑generated.  Keys
+      combine a hash of the normalised prompt with the backend's namespace
+      (backend, model and dimensions).  A legacy ``.json`` cache is only
+      imported when the namespace matches *legacy_model*.
+    * Missing embeddings are requested from *backend*.  Every completed batch
+      is checkpointed to the store's journal, so an interrupted run resumes
+      with only the still‑missing prompts.
+    * Afterwards the cache is trimmed to *cache_max_mb* / *cache_max_age_days*
+      (least recently used rows first) when either limit is given.
+    * The returned DataFrame has the same index as *prompts*.  With *spill*
+      (an open temporary file) its values live in a float32 memory map on
+      that file instead of in RAM.
+    """
+
+    texts = prompts.tolist()
+
+    if cache_path is None:
+        # Duplicated prompts only need to be embedded once.
+        unique = list(dict.fromkeys(texts))
+        print(f"Embedding {len(unique)} new prompt(s)…", flush=True)
+        new_embeddings = backend.embed(unique)
+        position = {t: i for i, t in enumerate(unique)}
+        rows = np.asarray([position[t] for t in texts], dtype=np.int64)
+        mat = np.asarray(new_embeddings, dtype=np.float32)
+        del new_embeddings
+        if spill is not None:
+            out = np.memmap(spill, dtype=np.float32, mode="w+", shape=(len(rows), mat.shape[1]))
+            out[:] = mat[rows]
+            return pd.DataFrame(out, index=prompts.index, copy=False)
+        return pd.DataFrame(mat[rows], index=prompts.index, copy=False)
+
+    cache, store = open_embedding_store(cache_path, backend.namespace, legacy_model)
+    keys = [store.key(t) for t in texts]
+    rows = store.lookup(keys)
+    missing = rows < 0
+    PROFILER.count("embedding_cache_hits", int((~missing).sum()))
+    PROFILER.count("embedding_cache_misses", int(missing.sum()))
+
+    if missing.any():
+        # Prompts sharing a key (duplicates after normalisation) are embedded once.
+        pending: dict[bytes, str] = {}
+        for key, text, miss in zip(keys, texts, missing):
+            if miss:
+                pending.setdefault(key, text)
+        texts_to_embed = list(pending.values())
+        print(f"Embedding {len(texts_to_embed)} new prompt(s)…", flush=True)
+
+        def checkpoint(batch: Sequence[str], vectors: list[list[float]]) -> None:
+            store.checkpoint([store.key(t) for t in batch], vectors)
+
+        try:
+            backend.embed(texts_to_embed, on_batch=checkpoint)
+        finally:
+            # Runs on success, errors and Ctrl‑C alike – whatever finished is kept.
+            store.compact()
+        rows = store.lookup(keys)
+
+    # Build a consistent embeddings matrix before eviction rewrites the files.
+    if spill is not None:
+        out = np.memmap(spill, dtype=np.float32, mode="w+", shape=(len(rows), store.dim))
+        mat = store.take(rows, out=out)
+    else:
+        mat = store.take(rows)
+
+    if cache_max_mb is not None or cache_max_age_days is not None:
+        max_bytes = int(cache_max_mb * 2**20) if cache_max_mb is not None else None
+        evicted = cache.evict(max_bytes=max_bytes, max_age_days=cache_max_age_days)
+        if evicted:
+            print(f"Evicted {evicted} cached embedding(s).", flush=True)
+
+    return pd.DataFrame(mat, index=prompts.index, copy=False)
+
+
+# ---------------------------------------------------------------------------
+# Embedding backends
+# ---------------------------------------------------------------------------
+
+
+class EmbeddingBackend(ABC):
+    """Interface of the embedding providers selectable via ``--embedding-backend``.
+
+    Subclasses implement :meth:`embed`.  :attr:`namespace` identifies the vector
+    space a backend produces and keeps the cache entries of different backends,
+    models and dimensions apart.
+    """
+
+    name = "base"
+    default_model = ""
+
+    def __init__(self, model: str | None = None, dimensions: int | None = None):
+        self.model = model or self.default_model
+        self.dimensions = dimensions
+
+    @property
+    def namespace(self) -> str:
+        # OpenAI keeps the bare model name so existing caches stay valid.
+        model = self.model if self.name == "openai" else f"{self.name}:{self.model}"
+        return cache_namespace(model, self.dimensions)
+
+    @abstractmethod
+    def embed(
+        self, texts: Sequence[str], on_batch: BatchCallback | None = None
+    ) -> list[list[float]] | None:
+        """Return the vectors of *texts* in order.
+
+        With *on_batch* every batch is handed to it as it completes instead of
+        being collected, and ``None`` is returned.
+        """
+
+
+class OpenAIBackend(EmbeddingBackend):
+    """Remote embeddings through :func:`embed_texts`; *options* are forwarded to it."""
+
+    name = "openai"
+    default_model = "text-embedding-3-small"
+
+    def __init__(self, model: str | None = None, dimensions: int | None = None, **options: Any):
+        super().__init__(model, dimensions)
+        self.options = options
+
+    def embed(self, texts, on_batch=None):
+        return embed_texts(
+            texts, self.model, dimensions=self.dimensions, on_batch=on_batch, **self.options
+        )
+
+
+class _LocalBackend(EmbeddingBackend):
+    """Base for CPU backends: fixed‑size batches embedded on a thread pool.
+
+    Batches are dispatched to *n_threads* workers (default: the backend's
+    ``default_threads``, else one per CPU) and handed to *on_batch* in input
+    order.  NumPy / PyTorch release the GIL for the heavy lifting, so threads
+    scale without copying the batches to other processes.
+    """
+
+    default_threads: int | None = None
+
+    def __init__(
+        self,
+        model: str | None = None,
+        dimensions: int | None = None,
+        *,
+        batch_size: int = 256,
+        n_threads: int | None = None,
+    ):
+        super().__init__(model, dimensions)
+        self.batch_size = batch_size
+        self.n_threads = n_threads or self.default_threads or os.cpu_count() or 1
+
+    @abstractmethod
+    def _embed_batch(self, batch: Sequence[str]) -> np.ndarray:
+        """Embed one batch into a ``(len(batch), dim)`` array."""
+
+    def embed(self, texts, on_batch=None):
+        batches = [texts[i : i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        print(
+            f"Embedding {len(texts)} text(s) locally with {self.name} "
+            f"({len(batches)} batch(es), {self.n_threads} thread(s)).",
+            flush=True,
+        )
+
+        embeddings: list[list[float]] = []
+        with ThreadPoolExecutor(self.n_threads) as pool:
+            for batch, mat in zip(batches, pool.map(self._embed_batch, batches)):
+                vectors = mat.astype(np.float32).tolist()
+                if on_batch is not None:
+                    on_batch(batch, vectors)
+                else:
+                    embeddings.extend(vectors)
+        return None if on_batch is not None else embeddings
+
+
+class HashingBackend(_LocalBackend):
+    """Offline TF‑IDF‑style embedder that needs nothing downloaded.
+
+    Word uni/bi‑grams and character 3–5‑grams are hashed into a sparse
+    sub‑linear TF vector and reduced to *dimensions* (default 256) with a fixed,
+    seeded sparse random projection.  Unlike a corpus‑fitted IDF/SVD the
+    transform is stateless, so cached vectors stay valid across runs.
+    """
+
+    name = "hashing"
+    default_model = "word-char-hash"
+    n_features = 2**18
+
+    def __init__(self, model=None, dimensions=None, **kwargs):
+        super().__init__(model, dimensions, **kwargs)
+
+        from sklearn.feature_extraction.text import HashingVectorizer  # type: ignore – lazy
+        from sklearn.random_projection import SparseRandomProjection  # type: ignore – lazy
+
+        common = dict(n_features=self.n_features, alternate_sign=False, norm=None)
+        self._word = HashingVectorizer(analyzer="word", ngram_range=(1, 2), **common)
+        self._char = HashingVectorizer(analyzer="char_wb", ngram_range=(3, 5), **common)
+        self._projection = SparseRandomProjection(
+            n_components=dimensions or 256, random_state=42, dense_output=True
+        ).fit(np.zeros((1, self.n_features)))
+
+    def _embed_batch(self, batch):
+        from sklearn.preprocessing import normalize  # type: ignore – lazy
+
+        tf = self._word.transform(batch) + self._char.transform(batch)
+        tf.data = 1 + np.log(tf.data)  # sub‑linear term frequency
+        return normalize(self._projection.transform(normalize(tf)))
+
+
+class SentenceTransformerBackend(_LocalBackend):
+    """Local transformer embeddings via the optional ``sentence-transformers`` package."""
+
+    name = "sentence-transformers"
+    default_model = "all-MiniLM-L6-v2"
+    default_threads = 1  # PyTorch already parallelises every batch across cores.
+
+    def __init__(self, model=None, dimensions=None, **kwargs):
+        super().__init__(model, dimensions, **kwargs)
+        try:
+            from sentence_transformers import SentenceTransformer  # type: ignore
+        except ImportError as exc:  # pragma: no cover – we do not test missing deps.
+            raise SystemExit(
+                "The 'sentence-transformers' package is required for this backend.\n"
+                "Run 'pip install sentence-transformers' and try again."
+            ) from exc
+        self._model = SentenceTransformer(self.model, truncate_dim=dimensions)
+
+    def _embed_batch(self, batch):
+        return self._model.encode(list(batch), normalize_embeddings=True)
+
+
+class FakeBackend(_LocalBackend):
+    """Deterministic pseudo‑random unit vectors for tests and benchmarks.
+
+    Every normalised text seeds its own generator, so the same text always
+    maps to the same vector (default 64 dimensions) without any I/O.
+    """
+
+    name = "fake"
+    default_model = "fake"
+
+    def _embed_batch(self, batch):
+        dim = self.dimensions or 64
+        out = np.empty((len(batch), dim), dtype=np.float32)
+        for i, text in enumerate(batch):
+            seed = int.from_bytes(_text_key(text, self.namespace)[:8], "little")
+            vec = np.random.default_rng(seed).standard_normal(dim)
+            out[i] = vec / np.linalg.norm(vec)
+        return out
+
+
+EMBEDDING_BACKENDS: dict[str, type[EmbeddingBackend]] = {
+    cls.name: cls
+    for cls in (OpenAIBackend, HashingBackend, SentenceTransformerBackend, FakeBackend)
+}
+
+
+def make_embedding_backend(
+    name: str,
+    model: str | None = None,
+    dimensions: int | None = None,
+    *,
+    n_threads: int | None = None,
+    **openai_options: Any,
+) -> EmbeddingBackend:
+    """Instantiate the backend called *name*.
+
+    *openai_options* (concurrency, rate limits, batching) only apply to the
+    OpenAI backend; *n_threads* only to the local ones.
+    """
+
+    if name == "openai":
+        return OpenAIBackend(model, dimensions, **openai_options)
+    return EMBEDDING_BACKENDS[name](model, dimensions, n_threads=n_threads)
+
+
+# ---------------------------------------------------------------------------
+# Clustering helpers
+# ---------------------------------------------------------------------------
+
+
+# Row count from which ``--dbscan-index auto`` switches to the approximate index.
+ANN_MIN_ROWS = 10_000
+
+
+def _lazy_import_sklearn_cluster():
+    """Lazy import helper for scikit‑learn *cluster* sub‑module."""
+
+    # Importing scikit‑learn is slow; defer until needed.
+    from sklearn.cluster import DBSCAN, KMeans  # type: ignore
+    from sklearn.metrics import silhouette_score  # type: ignore
+    from sklearn.preprocessing import StandardScaler  # type: ignore
+
+    return KMeans, DBSCAN, silhouette_score, StandardScaler
+
+
+def _iter_chunks(matrix: np.ndarray, chunk_size: int):
+    """Yield consecutive row blocks of *matrix* as dense float32 arrays.
+
+    Only one block is materialised at a time, so *matrix* may be a
+    :class:`numpy.memmap` much larger than the available RAM.
+    """
+
+    for start in range(0, len(matrix), chunk_size):
+        yield np.asarray(matrix[start : start + chunk_size], dtype=np.float32)
+
+
+K_CRITERIA = ("silhouette", "simplified-silhouette", "calinski-harabasz", "davies-bouldin")
+
 
-    try:
-        import openai  # type: ignore
+class KSelector:
+    """Score candidate clusterings during the *k* sweep and cache the results.
 
-        return openai
-    except ImportError as exc:  # pragma: no cover – we do not test missing deps.
-        raise SystemExit(
-            "The 'openai' package is required but not installed.\n"
-            "Run 'pip install openai' and try again."
-        ) from exc
+    Supported criteria:
 
+    * ``silhouette`` – exact silhouette on a stratified sample of at most
+      *sample_size* rows (all rows when ``sample_size`` is ``0``), which keeps
+      the O(n²) cost bounded.
+    * ``simplified-silhouette`` – centroid‑based silhouette, O(n·k).
+    * ``calinski-harabasz`` / ``davies-bouldin`` – cheap variance ratios.
 
-def embed_texts(texts: Sequence[str], model: str, batch_size: int = 100) -> list[list[float]]:
-    """Embed *texts* with OpenAI and return a list of vectors.
+    Scores are cached per *k* so callers can look them up again (e.g. for the
+    report) without recomputation.  :meth:`is_better` hides whether the chosen
+    criterion is maximised or minimised.
+    """
 
-    Uses batching for efficiency but remains on the safe side regarding current
-    OpenAI rate limits (can be adjusted by changing *batch_size*).
+    def __init__(self, criterion: str = "silhouette", sample_size: int = 10_000):
+        if criterion not in K_CRITERIA:
+            raise ValueError(f"Unknown k‑selection criterion {criterion!r}.")
+        self.criterion = criterion
+        self.sample_size = sample_size
+        self.scores: dict[int, float] = {}
+
+    @property
+    def label(self) -> str:
+        """Human‑readable criterion name for reports."""
+
+        return {
+            "silhouette": "Silhouette",
+            "simplified-silhouette": "Simplified silhouette",
+            "calinski-harabasz": "Calinski‑Harabasz",
+            "davies-bouldin": "Davies‑Bouldin",
+        }[self.criterion]
+
+    def is_better(self, score: float, best: float | None) -> bool:
+        if best is None:
+            return True
+        return score < best if self.criterion == "davies-bouldin" else score > best
+
+    def score(self, matrix: np.ndarray, k: int, labels: np.ndarray, centers: np.ndarray) -> float:
+        """Return (and cache) the criterion for clustering *labels* with *k* clusters.
+
+        Raises :class:`ValueError` for degenerate clusterings, just like the
+        scikit‑learn metrics do.
+        """
+
+        if k in self.scores:
+            return self.scores[k]
+        if len(np.unique(labels)) < 2:
+            raise ValueError("At least two clusters are required for scoring.")
+
+        from sklearn import metrics  # type: ignore – heavy, lazy import.
+
+        if self.criterion == "silhouette":
+            idx = _stratified_sample(labels, self.sample_size)
+            value = metrics.silhouette_score(np.asarray(matrix[idx]), labels[idx])
+        elif self.criterion == "simplified-silhouette":
+            value = _simplified_silhouette(matrix, labels, centers)
+        elif self.criterion == "calinski-harabasz":
+            value = metrics.calinski_harabasz_score(matrix, labels)
+        else:
+            value = metrics.davies_bouldin_score(matrix, labels)
+
+        self.scores[k] = float(value)
+        return self.scores[k]
+
+
+def _stratified_sample(labels: np.ndarray, size: int, seed: int = 42) -> np.ndarray:
+    """Return sorted row indices sampling every label proportionally to its size.
+
+    Each cluster keeps at least two members (when it has them) so silhouette
+    stays defined.  ``size <= 0`` or ``size >= len(labels)`` selects all rows.
     """
 
-    openai = _lazy_import_openai()
-    client = openai.OpenAI()
+    n = len(labels)
+    if size <= 0 or size >= n:
+        return np.arange(n)
+
+    rng = np.random.default_rng(seed)
+    order = np.argsort(labels, kind="stable")
+    _, starts, counts = np.unique(labels[order], return_index=True, return_counts=True)
+    quotas = np.minimum(counts, np.maximum(2, np.round(counts * size / n).astype(int)))
+
+    picked = [
+        order[start + rng.choice(count, size=quota, replace=False)]
+        for start, count, quota in zip(starts, counts, quotas)
+    ]
+    return np.sort(np.concatenate(picked))
+
+
+def _simplified_silhouette(
+    matrix: np.ndarray, labels: np.ndarray, centers: np.ndarray, chunk_size: int = 8192
+) -> float:
+    """Centroid‑based silhouette: *a* / *b* are distances to own / nearest other centroid."""
+
+    total = 0.0
+    for start, chunk in zip(range(0, len(matrix), chunk_size), _iter_chunks(matrix, chunk_size)):
+        lbl = labels[start : start + len(chunk)]
+        dist = np.sqrt(
+            np.maximum(
+                (chunk**2).sum(1)[:, None] - 2 * chunk @ centers.T + (centers**2).sum(1)[None, :],
+                0,
+            )
+        )
+        rows = np.arange(len(chunk))
+        a = dist[rows, lbl]
+        dist[rows, lbl] = np.inf
+        b = dist.min(axis=1)
+        total += float(((b - a) / np.maximum(np.maximum(a, b), 1e-12)).sum())
+    return total / len(matrix)
 
-    embeddings: list[list[float]] = []
 
-    for batch_start in range(0, len(texts), batch_size):
-        batch = texts[batch_start : batch_start + batch_size]
+@dataclass
+class ClusterResult:
+    """Outcome of a clustering run, shared by every downstream stage.
 
-        response = client.embeddings.create(input=batch, model=model)
-        # The API returns the vectors in the same order as the input list.
-        embeddings.extend(data.embedding for data in response.data)
+    Holds the fitted estimator so centroid distances (ambiguity detection,
+    reporting, plotting) never require refitting, plus the selection score and
+    the per‑k diagnostics collected during the sweep.
+    """
 
-    return embeddings
+    method: str
+    labels: np.ndarray
+    model: Any = None
+    k: int | None = None
+    score: float | None = None
+    criterion: str | None = None
+    diagnostics: list[dict[str, float]] = field(default_factory=list)
 
+    @property
+    def centers(self) -> np.ndarray | None:
+        """Cluster centroids (K‑Means variants only)."""
+
+        return getattr(self.model, "cluster_centers_", None)
 
-def load_or_create_embeddings(
-    prompts: pd.Series, *, cache_path: Path | None, model: str
-) -> pd.DataFrame:
-    """Return a *DataFrame* with one row per prompt and the embedding columns.
 
-    * If *cache_path* is provided and exists, known embeddings are loaded from
-      the JSON cache so they don't have to be re‑generated.
-    * Missing embeddings are requested from the OpenAI API and subsequently
-      appended to the cache.
-    * The returned DataFrame has the same index as *prompts*.
+@contextlib.contextmanager
+def _shared_matrix(matrix: np.ndarray):
+    """Yield a picklable ``(path, offset, shape)`` handle to *matrix* on disk.
+
+    A float32 :class:`numpy.memmap` – or a plain view spanning all of one, as
+    pandas hands out – is shared as‑is; any other array is written once to a
+    temporary file.  Workers re‑open it with :func:`_open_shared_matrix`, so
+    the matrix is never pickled and the OS page cache is shared.
     """
 
-    cache: dict[str, list[float]] = {}
-    if cache_path and cache_path.exists():
+    base = matrix
+    while not isinstance(base, np.memmap) and isinstance(base.base, np.ndarray):
+        base = base.base
+    if (
+        isinstance(base, np.memmap)
+        and base.filename
+        and matrix.dtype == base.dtype == np.float32
+        and matrix.flags.c_contiguous
+        and base.flags.c_contiguous
+        and matrix.shape == base.shape
+        and matrix.ctypes.data == base.ctypes.data
+    ):
+        yield (base.filename, base.offset, matrix.shape)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="cluster_prompts_") as tmp:
+        path = Path(tmp) / "matrix.f32"
+        np.ascontiguousarray(matrix, dtype=np.float32).tofile(path)
+        yield (str(path), 0, matrix.shape)
+
+
+def _open_shared_matrix(handle: tuple[str, int, tuple[int, ...]]) -> np.ndarray:
+    path, offset, shape = handle
+    return np.memmap(path, dtype=np.float32, mode="r", offset=offset, shape=shape)
+
+
+def _fit_candidate(
+    handle: tuple[str, int, tuple[int, ...]],
+    k: int,
+    criterion: str,
+    sample_size: int,
+    threads: int,
+    sample_weight: np.ndarray | None = None,
+):
+    """Process‑pool worker: fit K‑Means with *k* clusters and score it."""
+
+    from threadpoolctl import threadpool_limits  # type: ignore – ships with scikit‑learn.
+
+    KMeans, _, _, _ = _lazy_import_sklearn_cluster()
+    matrix = _open_shared_matrix(handle)
+
+    # Every worker gets its share of the cores instead of all of them.
+    with threadpool_limits(limits=threads):
+        model = KMeans(n_clusters=k, random_state=42, n_init="auto").fit(
+            matrix, sample_weight=sample_weight
+        )
         try:
-            cache = json.loads(cache_path.read_text())
-        except json.JSONDecodeError:  # pragma: no cover – unlikely.
-            print("⚠️  Cache file exists but is not valid JSON – ignoring.", file=sys.stderr)
+            score = KSelector(criterion, sample_size).score(
+                matrix, k, model.labels_, model.cluster_centers_
+            )
+        except ValueError:
+            score = None
+    return k, score, model
 
-    missing_mask = ~prompts.isin(cache)
 
-    if missing_mask.any():
-        texts_to_embed = prompts[missing_mask].tolist()
-        print(f"Embedding {len(texts_to_embed)} new prompt(s)…", flush=True)
-        new_embeddings = embed_texts(texts_to_embed, model=model)
+def _sweep_k(
+    matrix: np.ndarray,
+    ks: Sequence[int],
+    selector: KSelector,
+    n_jobs: int,
+    sample_weight: np.ndarray | None = None,
+):
+    """Yield ``(k, score | None, fitted_model)`` for every *k*, in ascending order.
 
-        # Update cache (regardless of whether we persist it to disk later on).
-        cache.update(dict(zip(texts_to_embed, new_embeddings)))
+    With ``n_jobs > 1`` the candidates are fitted in a process pool that reads
+    the matrix through a shared memory map.  Closing the generator early (see
+    ``patience`` in :func:`cluster_kmeans`) cancels candidates not yet started.
+    """
 
-        if cache_path:
-            cache_path.parent.mkdir(parents=True, exist_ok=True)
-            cache_path.write_text(json.dumps(cache))
+    if n_jobs <= 1:
+        KMeans, _, _, _ = _lazy_import_sklearn_cluster()
+        for k in ks:
+            with PROFILER.stage("kmeans fit"):
+                model = KMeans(n_clusters=k, random_state=42, n_init="auto").fit(
+                    matrix, sample_weight=sample_weight
+                )
+            try:
+                with PROFILER.stage("k score"):
+                    score = selector.score(matrix, k, model.labels_, model.cluster_centers_)
+            except ValueError:
+                score = None
+            yield k, score, model
+        return
+
+    threads = max(1, (os.cpu_count() or 1) // n_jobs)
+    # "spawn" avoids forking a parent whose OpenMP / BLAS pools are already running.
+    ctx = multiprocessing.get_context("spawn")
+    with _shared_matrix(matrix) as handle, ProcessPoolExecutor(n_jobs, mp_context=ctx) as pool:
+        futures = [
+            pool.submit(
+                _fit_candidate,
+                handle,
+                k,
+                selector.criterion,
+                selector.sample_size,
+                threads,
+                sample_weight,
+            )
+            for k in ks
+        ]
+        try:
+            for future in futures:
+                k, score, model = future.result()
+                if score is not None:
+                    selector.scores[k] = score
+                yield k, score, model
+        finally:
+            for future in futures:
+                future.cancel()
 
-    # Build a consistent embeddings matrix
-    vectors = prompts.map(cache.__getitem__).tolist()  # type: ignore[arg-type]
-    mat = np.array(vectors, dtype=np.float32)
-    return pd.DataFrame(mat, index=prompts.index)
 
+def cluster_kmeans(
+    matrix: np.ndarray,
+    k_max: int,
+    selector: KSelector | None = None,
+    *,
+    n_jobs: int = 1,
+    patience: int = 0,
+    sample_weight: np.ndarray | None = None,
+) -> ClusterResult:
+    """Auto‑select *k* (in ``[2, k_max]``) via *selector* and cluster.
+
+    *selector* defaults to a sampled silhouette :class:`KSelector`; pass your
+    own to pick another criterion or to read the per‑k scores afterwards.
+
+    The candidates are independent and are fitted on *n_jobs* processes
+    (``0`` = one per CPU).  With *patience* > 0 the sweep stops once that many
+    consecutive values of *k* failed to beat the best score so far.
+    *sample_weight* (e.g. duplicate counts) weights the K‑Means fit; the
+    selection criteria score the distinct rows.
+
+    The winning fitted model is returned inside a :class:`ClusterResult`
+    together with the per‑k scores and inertia.
+    """
 
-# ---------------------------------------------------------------------------
-# Clustering helpers
-# ---------------------------------------------------------------------------
+    selector = selector or KSelector()
+    if n_jobs <= 0:
+        n_jobs = os.cpu_count() or 1
+    ks = list(range(2, k_max + 1))
 
+    best_k = None
+    best_score: float | None = None
+    best_model = None
+    diagnostics: list[dict[str, float]] = []
+    since_best = 0
 
-def _lazy_import_sklearn_cluster():
-    """Lazy import helper for scikit‑learn *cluster* sub‑module."""
+    candidates = _sweep_k(matrix, ks, selector, min(n_jobs, len(ks)), sample_weight)
+    try:
+        for k, score, model in candidates:
+            recorded = float("nan") if score is None else score
+            diagnostics.append({"k": k, "score": recorded, "inertia": model.inertia_})
+            if score is not None and selector.is_better(score, best_score):
+                best_k = k
+                best_score = score
+                best_model = model
+                since_best = 0
+            else:
+                # Also covers degenerate candidates (a cluster with 1 sample).
+                since_best += 1
+
+            if patience and best_k is not None and since_best >= patience:
+                print(f"Score peaked at k={best_k}; stopping the sweep at k={k}.", flush=True)
+                break
+    finally:
+        candidates.close()
+
+    if best_model is None:  # pragma: no cover – highly unlikely.
+        raise RuntimeError("Unable to find a suitable number of clusters.")
 
-    # Importing scikit‑learn is slow; defer until needed.
-    from sklearn.cluster import DBSCAN, KMeans  # type: ignore
-    from sklearn.metrics import silhouette_score  # type: ignore
-    from sklearn.preprocessing import StandardScaler  # type: ignore
+    print(f"K‑Means selected k={best_k} ({selector.criterion}={best_score:.3f}).", flush=True)
+    return ClusterResult(
+        method="kmeans",
+        labels=best_model.labels_,
+        model=best_model,
+        k=best_k,
+        score=best_score,
+        criterion=selector.label,
+        diagnostics=diagnostics,
+    )
 
-    return KMeans, DBSCAN, silhouette_score, StandardScaler
 
+def cluster_minibatch_kmeans(
+    matrix: np.ndarray,
+    k_max: int,
+    *,
+    sample_size: int = 20_000,
+    chunk_size: int = 8192,
+    n_passes: int = 2,
+    selector: KSelector | None = None,
+    sample_weight: np.ndarray | None = None,
+) -> ClusterResult:
+    """Scalable K‑Means variant for corpora that do not fit in memory.
+
+    1.  *k* is selected (via *selector*, ``[2, k_max]``) on a uniform random
+        sample of at most *sample_size* rows, so the sweep cost depends on the
+        sample rather than the corpus.
+    2.  The winning sample centroids seed a :class:`MiniBatchKMeans` that is
+        refined with ``partial_fit`` over *n_passes* streamed passes of
+        *chunk_size* rows.
+    3.  Labels are assigned chunk by chunk.
+
+    *sample_weight* (e.g. duplicate counts) weights both fits.
+    """
 
-def cluster_kmeans(matrix: np.ndarray, k_max: int) -> np.ndarray:
-    """Auto‑select *k* (in ``[2, k_max]``) via Silhouette score and cluster."""
+    from sklearn.cluster import MiniBatchKMeans  # type: ignore – heavy, lazy import.
 
-    KMeans, _, silhouette_score, _ = _lazy_import_sklearn_cluster()
+    selector = selector or KSelector()
 
-    best_k = None
-    best_score = -1.0
-    best_labels: np.ndarray | None = None
+    n = len(matrix)
+    rng = np.random.default_rng(42)
+    sample_idx = np.sort(rng.choice(n, size=min(sample_size, n), replace=False))
+    sample = np.asarray(matrix[sample_idx], dtype=np.float32)
+    sample_w = None if sample_weight is None else sample_weight[sample_idx]
 
-    for k in range(2, k_max + 1):
-        model = KMeans(n_clusters=k, random_state=42, n_init="auto")
-        labels = model.fit_predict(matrix)
+    best_k = None
+    best_score: float | None = None
+    best_centers: np.ndarray | None = None
+    diagnostics: list[dict[str, float]] = []
+
+    for k in range(2, min(k_max, len(sample) - 1) + 1):
+        model = MiniBatchKMeans(n_clusters=k, random_state=42, n_init=3, batch_size=chunk_size)
+        with PROFILER.stage("kmeans fit"):
+            labels = model.fit_predict(sample, sample_weight=sample_w)
         try:
-            score = silhouette_score(matrix, labels)
+            with PROFILER.stage("k score"):
+                score = selector.score(sample, k, labels, model.cluster_centers_)
         except ValueError:
             # Occurs when a cluster ended up with 1 sample – skip.
             continue
+        diagnostics.append({"k": k, "score": score, "inertia": model.inertia_})
 
-        if score > best_score:
+        if selector.is_better(score, best_score):
             best_k = k
             best_score = score
-            best_labels = labels
+            best_centers = model.cluster_centers_
 
-    if best_labels is None:  # pragma: no cover – highly unlikely.
+    if best_centers is None:  # pragma: no cover – highly unlikely.
         raise RuntimeError("Unable to find a suitable number of clusters.")
 
-    print(f"K‑Means selected k={best_k} (silhouette={best_score:.3f}).", flush=True)
-    return best_labels
+    print(
+        f"Mini‑batch K‑Means selected k={best_k} on {len(sample)} sampled prompts "
+        f"({selector.criterion}={best_score:.3f}).",
+        flush=True,
+    )
+
+    model = MiniBatchKMeans(
+        n_clusters=best_k, init=best_centers, n_init=1, random_state=42, batch_size=chunk_size
+    )
+    with PROFILER.stage("refit"):
+        for _ in range(n_passes):
+            for start, chunk in zip(range(0, n, chunk_size), _iter_chunks(matrix, chunk_size)):
+                # ``partial_fit`` needs at least k rows – fold a short tail into the next pass.
+                if len(chunk) >= best_k:
+                    weight = (
+                        None
+                        if sample_weight is None
+                        else sample_weight[start : start + len(chunk)]
+                    )
+                    model.partial_fit(chunk, sample_weight=weight)
+
+    with PROFILER.stage("assign"):
+        labels = np.concatenate(
+            [model.predict(chunk) for chunk in _iter_chunks(matrix, chunk_size)]
+        )
+    return ClusterResult(
+        method="minibatch-kmeans",
+        labels=labels,
+        model=model,
+        k=best_k,
+        score=best_score,
+        criterion=f"{selector.label} (sample)",
+        diagnostics=diagnostics,
+    )
+
+
+def _matrix_fingerprint(matrix: np.ndarray, chunk_size: int = 8192) -> str:
+    """Stable content hash of *matrix* (shape + float32 bytes), streamed in chunks."""
 
+    digest = hashlib.blake2b(str(matrix.shape).encode("utf-8"), digest_size=16)
+    for chunk in _iter_chunks(matrix, chunk_size):
+        digest.update(np.ascontiguousarray(chunk).tobytes())
+    return digest.hexdigest()
 
-def cluster_dbscan(matrix: np.ndarray, min_samples: int) -> np.ndarray:
-    """Cluster with DBSCAN; *eps* is estimated via the k‑distance method."""
+
+def _prune_stale(path: Path, pattern: str) -> int:
+    """Delete the files next to *path* matching *pattern*, except *path*; return #removed.
+
+    Derived artefacts keyed by a matrix fingerprint (ANN indexes, projections)
+    only match a byte‑identical rerun, so older ones are dead weight once a
+    newer matrix has been processed.
+    """
+
+    removed = 0
+    for stale in path.parent.glob(pattern):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+class IVFIndex:
+    """Inverted‑file approximate nearest‑neighbour index built with NumPy.
+
+    A coarse mini‑batch K‑Means quantizer splits the rows into ``nlist``
+    cells.  Neighbourhood queries for all rows are answered cell by cell: the
+    members of a cell are compared (with one matrix product) against the
+    members of the ``nprobe`` cells whose centroids are closest, instead of
+    against the whole matrix.  Only the quantizer and the cell assignment are
+    stored; the vectors stay in the caller's matrix.
+    """
+
+    def __init__(self, centroids: np.ndarray, assignment: np.ndarray):
+        self.centroids = centroids
+        self.assignment = assignment
+        # Rows grouped by cell: ``order[offsets[c]:offsets[c + 1]]`` are cell *c*.
+        self.order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=len(centroids))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, nlist: int | None = None, chunk_size: int = 8192):
+        from sklearn.cluster import MiniBatchKMeans  # type: ignore – heavy, lazy import.
+
+        n = len(matrix)
+        nlist = nlist or max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(42)
+        train = np.asarray(matrix[np.sort(rng.choice(n, min(n, 64 * nlist), replace=False))])
+        quantizer = MiniBatchKMeans(n_clusters=nlist, random_state=42, n_init=1).fit(train)
+        assignment = np.concatenate(
+            [quantizer.predict(chunk) for chunk in _iter_chunks(matrix, chunk_size)]
+        )
+        return cls(quantizer.cluster_centers_.astype(np.float32), assignment)
+
+    def save(self, path: Path, fingerprint: str) -> None:
+        """Save to *path*, replacing the indexes of earlier matrices next to it."""
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(tmp, centroids=self.centroids, assignment=self.assignment, fingerprint=fingerprint)
+        os.replace(tmp, path)
+        _prune_stale(path, "ivf-*.npz")
+
+    @classmethod
+    def load(cls, path: Path, fingerprint: str) -> IVFIndex | None:
+        """Load the index at *path* if it was built for the same matrix."""
+
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            if str(data["fingerprint"]) != fingerprint:
+                return None
+            return cls(data["centroids"], data["assignment"])
+
+    def _probe_blocks(self, matrix: np.ndarray, nprobe: int):
+        """Yield ``(query_rows, candidate_rows, squared_distances)`` per cell."""
+
+        nprobe = min(nprobe, len(self.centroids))
+        c = self.centroids
+        cell_dist = (c**2).sum(1)[:, None] - 2 * c @ c.T + (c**2).sum(1)[None, :]
+        probes = np.argsort(cell_dist, axis=1)[:, :nprobe]
+
+        for cell in range(len(c)):
+            queries = self.order[self.offsets[cell] : self.offsets[cell + 1]]
+            if not len(queries):
+                continue
+            candidates = np.concatenate(
+                [self.order[self.offsets[p] : self.offsets[p + 1]] for p in probes[cell]]
+            )
+            q = np.asarray(matrix[queries], dtype=np.float32)
+            x = np.asarray(matrix[candidates], dtype=np.float32)
+            d2 = (q**2).sum(1)[:, None] - 2 * q @ x.T + (x**2).sum(1)[None, :]
+            yield queries, candidates, np.maximum(d2, 0)
+
+    def kth_neighbor_distance(self, matrix: np.ndarray, k: int, nprobe: int = 8) -> np.ndarray:
+        """Approximate distance of every row to its *k*‑th nearest row (itself included)."""
+
+        out = np.full(len(matrix), np.inf, dtype=np.float32)
+        for queries, candidates, d2 in self._probe_blocks(matrix, nprobe):
+            if d2.shape[1] >= k:
+                out[queries] = np.sqrt(np.partition(d2, k - 1, axis=1)[:, k - 1])
+        return out
+
+    def radius_graph(self, matrix: np.ndarray, eps: float, nprobe: int = 8):
+        """Sparse, symmetric CSR graph of approximate pairwise distances ``<= eps``.
+
+        Suitable as input for ``DBSCAN(metric="precomputed")``, which then only
+        looks at the stored neighbours instead of a dense n×n matrix.  Cell A
+        may probe cell B without B probing A, so every edge found is stored in
+        both directions – DBSCAN assumes symmetric neighbourhoods.  With
+        *nprobe* covering every cell the graph equals the exact one.
+        """
+
+        from scipy import sparse  # type: ignore – ships with scikit‑learn.
+
+        rows, cols, data = [], [], []
+        for queries, candidates, d2 in self._probe_blocks(matrix, nprobe):
+            qi, ci = np.nonzero(d2 <= eps * eps)
+            rows.append(queries[qi])
+            cols.append(candidates[ci])
+            data.append(np.sqrt(d2[qi, ci]))
+
+        n = len(matrix)
+        rows, cols, data = np.concatenate(rows), np.concatenate(cols), np.concatenate(data)
+        # Add the reverse of every edge, then drop duplicates.  Not
+        # ``graph.maximum(graph.T)``: that would discard stored zero distances
+        # (identical prompts), which DBSCAN must still count as neighbours.
+        rows, cols = np.concatenate([rows, cols]), np.concatenate([cols, rows])
+        data = np.concatenate([data, data])
+        _, first = np.unique(rows.astype(np.int64) * n + cols, return_index=True)
+        return sparse.csr_matrix((data[first], (rows[first], cols[first])), shape=(n, n))
+
+
+def cluster_dbscan(
+    matrix: np.ndarray,
+    min_samples: int,
+    *,
+    index: str = "auto",
+    nprobe: int = 8,
+    index_dir: Path | None = None,
+    sample_weight: np.ndarray | None = None,
+    check: bool = False,
+) -> ClusterResult:
+    """Cluster with DBSCAN; *eps* is estimated via the k‑distance method.
+
+    With ``index="ivf"`` (default for large inputs when ``index="auto"``) both
+    the k‑distance pass and DBSCAN's region queries go through an approximate
+    :class:`IVFIndex` probing *nprobe* cells.  The index is saved in
+    *index_dir* (usually next to the embedding cache) and reused by later runs
+    on the same matrix.  *sample_weight* (e.g. duplicate counts) counts towards
+    *min_samples*, so a prompt repeated often enough forms a core point.
+
+    With *check* the IVF labels are compared against exact DBSCAN at the same
+    *eps*; probing every cell must give an adjusted Rand index of 1.
+    """
 
     _, DBSCAN, _, StandardScaler = _lazy_import_sklearn_cluster()
 
     # Scale features – DBSCAN is sensitive to feature scale.
     scaler = StandardScaler()
-    matrix_scaled = scaler.fit_transform(matrix)
+    matrix_scaled = scaler.fit_transform(matrix).astype(np.float32)
+
+    if index == "auto":
+        index = "ivf" if len(matrix) >= ANN_MIN_ROWS else "exact"
+
+    if index == "exact":
+        # Heuristic: use a high percentile of the distances to the
+        # ``min_samples``‑th nearest neighbour as eps. This is a commonly used
+        # rule of thumb.
+        from sklearn.neighbors import NearestNeighbors  # type: ignore  # lazy import
+
+        neigh = NearestNeighbors(n_neighbors=min_samples)
+        neigh.fit(matrix_scaled)
+        distances, _ = neigh.kneighbors(matrix_scaled)
+        kth_distances = distances[:, -1]
+        eps = float(np.percentile(kth_distances, 90))  # choose a high‑ish value.
+
+        print(f"DBSCAN min_samples={min_samples}, eps={eps:.3f}", flush=True)
+        model = DBSCAN(eps=eps, min_samples=min_samples)
+        labels = model.fit_predict(matrix_scaled, sample_weight=sample_weight)
+        return ClusterResult(method="dbscan", labels=labels, model=model)
+
+    fingerprint = _matrix_fingerprint(matrix_scaled)
+    index_path = index_dir / f"ivf-{fingerprint}.npz" if index_dir else None
+    ivf = IVFIndex.load(index_path, fingerprint) if index_path else None
+    if ivf is None:
+        with PROFILER.stage("ann index"):
+            ivf = IVFIndex.build(matrix_scaled)
+        if index_path:
+            ivf.save(index_path, fingerprint)
+    else:
+        print(f"Reusing ANN index {index_path}.", flush=True)
 
-    # Heuristic: use the median of the distances to the ``min_samples``‑th
-    # nearest neighbour as eps. This is a commonly used rule of thumb.
-    from sklearn.neighbors import NearestNeighbors  # type: ignore  # lazy import
+    kth_distances = ivf.kth_neighbor_distance(matrix_scaled, min_samples, nprobe=nprobe)
+    eps = float(np.percentile(kth_distances[np.isfinite(kth_distances)], 90))
+
+    print(
+        f"DBSCAN min_samples={min_samples}, eps={eps:.3f} "
+        f"(IVF index, {len(ivf.centroids)} cells, nprobe={nprobe})",
+        flush=True,
+    )
+    model = DBSCAN(eps=eps, min_samples=min_samples, metric="precomputed")
+    labels = model.fit_predict(
+        ivf.radius_graph(matrix_scaled, eps, nprobe=nprobe), sample_weight=sample_weight
+    )
 
-    neigh = NearestNeighbors(n_neighbors=min_samples)
-    neigh.fit(matrix_scaled)
-    distances, _ = neigh.kneighbors(matrix_scaled)
-    kth_distances = distances[:, -1]
-    eps = float(np.percentile(kth_distances, 90))  # choose a high‑ish value.
+    if check:
+        from sklearn.metrics import adjusted_rand_score  # type: ignore  # lazy import
 
-    print(f"DBSCAN min_samples={min_samples}, eps={eps:.3f}", flush=True)
-    model = DBSCAN(eps=eps, min_samples=min_samples)
-    return model.fit_predict(matrix_scaled)
+        exact = DBSCAN(eps=eps, min_samples=min_samples).fit_predict(
+            matrix_scaled, sample_weight=sample_weight
+        )
+        agreement = adjusted_rand_score(exact, labels)
+        print(f"IVF vs exact DBSCAN: adjusted Rand index {agreement:.4f}.", flush=True)
+        if nprobe >= len(ivf.centroids) and not np.array_equal(exact, labels):
+            raise AssertionError("IVF probing every cell must reproduce exact DBSCAN.")
+    return ClusterResult(method="dbscan", labels=labels, model=model)
 
 
 # ---------------------------------------------------------------------------
-# Cluster labelling helpers (LLM)
+# Cluster statistics
 # ---------------------------------------------------------------------------
 
 
-def label_clusters(
-    df: pd.DataFrame, labels: np.ndarray, chat_model: str, max_examples: int = 12
-) -> dict[int, dict[str, str]]:
-    """Generate a name & description for each cluster label via ChatGPT.
+AMBIGUITY_THRESHOLD = 0.9
+
+
+class ClusterStats:
+    """Every per‑cluster number the report, plots and labelling need.
 
-    Returns a mapping ``label -> {"name": str, "description": str}``.
+    Built once from the embedding matrix and the labels: sizes come from
+    ``np.bincount``, centroids from one grouped reduction, and a single chunked
+    pass over the rows yields each row's distance to its own centroid, the
+    intra‑cluster dispersion and – for K‑Means – the ambiguous rows (nearest /
+    second‑nearest centroid ratio above *ambiguity_threshold*).  A grouped sort
+    – ``lexsort((distance, label))`` – then makes :meth:`nearest` (most
+    representative) and :meth:`farthest` (least typical) O(1) slices.
+
+    With *weights* (duplicate counts from :func:`read_prompts`) centroids,
+    :attr:`sizes` and dispersion reflect the original volume, while
+    :attr:`counts` holds the number of distinct rows per cluster.
+
+    Row indices returned by the methods and :attr:`noise` / :attr:`ambiguous`
+    are *positional*.
     """
 
-    openai = _lazy_import_openai()
-    client = openai.OpenAI()
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        labels: np.ndarray,
+        centers: np.ndarray | None = None,
+        *,
+        weights: np.ndarray | None = None,
+        ambiguity_threshold: float = AMBIGUITY_THRESHOLD,
+        chunk_size: int = 8192,
+    ):
+        self.labels = np.asarray(labels)
+        self.cluster_ids, inverse = np.unique(self.labels, return_inverse=True)
+        self.counts = np.bincount(inverse, minlength=len(self.cluster_ids))
+        self.weights = None if weights is None else np.asarray(weights, dtype=np.float64)
+        self.sizes = (
+            self.counts
+            if self.weights is None
+            else np.bincount(inverse, weights=self.weights, minlength=len(self.cluster_ids))
+            .round()
+            .astype(np.int64)
+        )
+        n_groups = len(self.cluster_ids)
+        starts = range(0, len(matrix), chunk_size)
+
+        # Use the model's centroids when they exist (K‑Means); otherwise the
+        # group means (DBSCAN, noise).
+        use_model = centers is not None and -1 not in self.cluster_ids
+        if use_model:
+            self.centroids = np.asarray(centers, dtype=np.float32)[self.cluster_ids]
+        else:
+            sums = np.zeros((n_groups, matrix.shape[1]), dtype=np.float64)
+            for start, chunk in zip(starts, _iter_chunks(matrix, chunk_size)):
+                if self.weights is not None:
+                    chunk = chunk * self.weights[start : start + len(chunk), None]
+                np.add.at(sums, inverse[start : start + len(chunk)], chunk)
+            self.centroids = (sums / self.sizes[:, None]).astype(np.float32)
+
+        # One pass: distance of every row to every centroid, from which we read
+        # the own‑centroid distance and, for K‑Means, the ambiguity ratio.
+        check_ambiguity = use_model and n_groups >= 2
+        sq_centroids = (self.centroids.astype(np.float64) ** 2).sum(1)
+        self.distances = np.empty(len(matrix), dtype=np.float32)
+        ambiguous = []
+        for start, chunk in zip(starts, _iter_chunks(matrix, chunk_size)):
+            chunk = np.asarray(chunk, dtype=np.float32)
+            dist = np.sqrt(
+                np.maximum(
+                    (chunk.astype(np.float64) ** 2).sum(1)[:, None]
+                    - 2 * chunk @ self.centroids.T
+                    + sq_centroids[None, :],
+                    0,
+                )
+            )
+            rows = np.arange(len(chunk))
+            stop = start + len(chunk)
+            self.distances[start:stop] = dist[rows, inverse[start:stop]]
+            if check_ambiguity:
+                two = np.partition(dist, 1, axis=1)[:, :2]
+                ratio = two[:, 0] / (two[:, 1] + 1e-9)
+                ambiguous.append(start + np.flatnonzero(ratio > ambiguity_threshold))
+
+        self.ambiguous = np.concatenate(ambiguous) if ambiguous else np.empty(0, dtype=np.intp)
+        weighted = self.distances if self.weights is None else self.distances * self.weights
+        self.mean_distance = np.bincount(inverse, weights=weighted, minlength=n_groups) / self.sizes
+        self.max_distance = np.zeros(n_groups)
+        np.maximum.at(self.max_distance, inverse, self.distances)
+
+        self.order = np.lexsort((self.distances, inverse))
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+        self._group = {int(lbl): i for i, lbl in enumerate(self.cluster_ids)}
+        self.noise = (
+            self.nearest(-1, len(self.labels))
+            if -1 in self._group
+            else np.empty(0, dtype=np.intp)
+        )
 
-    out: dict[int, dict[str, str]] = {}
+        # Nearest other cluster by centroid distance (noise excluded).
+        real = np.flatnonzero(self.cluster_ids != -1)
+        self.neighbor = np.full(n_groups, -1)
+        self.neighbor_distance = np.full(n_groups, np.nan)
+        if len(real) >= 2:
+            c = self.centroids[real].astype(np.float64)
+            sq = (c**2).sum(1)
+            between = np.sqrt(np.maximum(sq[:, None] - 2 * c @ c.T + sq[None, :], 0))
+            np.fill_diagonal(between, np.inf)
+            closest = between.argmin(axis=1)
+            self.neighbor[real] = self.cluster_ids[real][closest]
+            self.neighbor_distance[real] = between[np.arange(len(real)), closest]
+
+    @property
+    def total(self) -> int:
+        """Number of prompts, counting duplicates."""
+
+        return int(self.sizes.sum())
+
+    def size(self, lbl: int) -> int:
+        """Prompts in cluster *lbl*, counting duplicates."""
+
+        return int(self.sizes[self._group[int(lbl)]])
+
+    def n_unique(self, lbl: int) -> int:
+        """Distinct rows in cluster *lbl*."""
+
+        return int(self.counts[self._group[int(lbl)]])
+
+    def spread(self, lbl: int) -> float:
+        """Mean distance of cluster *lbl*'s rows to its centroid."""
+
+        return float(self.mean_distance[self._group[int(lbl)]])
+
+    def nearest_cluster(self, lbl: int) -> int | None:
+        """Label of the cluster whose centroid is closest to *lbl*'s."""
+
+        other = int(self.neighbor[self._group[int(lbl)]])
+        return None if other == -1 else other
+
+    def nearest(self, lbl: int, n: int) -> np.ndarray:
+        """Rows of cluster *lbl* closest to its centroid (closest first)."""
+
+        g = self._group[int(lbl)]
+        start = self.offsets[g]
+        return self.order[start : min(start + n, self.offsets[g + 1])]
+
+    def farthest(self, lbl: int, n: int) -> np.ndarray:
+        """Rows of cluster *lbl* farthest from its centroid (farthest first)."""
+
+        g = self._group[int(lbl)]
+        end = self.offsets[g + 1]
+        return self.order[max(end - n, self.offsets[g]) : end][::-1]
+
+    def to_dict(self, result: ClusterResult, meta: dict[int, dict[str, str]]) -> dict[str, Any]:
+        """JSON‑serialisable summary (no embeddings) for dashboards."""
+
+        clusters = []
+        for g, lbl in enumerate(self.cluster_ids.tolist()):
+            info = meta.get(lbl, {})
+            clusters.append(
+                {
+                    "label": lbl,
+                    "name": info.get("name") if lbl != -1 else "noise",
+                    "description": info.get("description"),
+                    "size": int(self.sizes[g]),
+                    "unique": int(self.counts[g]),
+                    "share": float(self.sizes[g] / self.total),
+                    "mean_distance": float(self.mean_distance[g]),
+                    "max_distance": float(self.max_distance[g]),
+                    "nearest_cluster": self.nearest_cluster(lbl),
+                    "nearest_cluster_distance": (
+                        None
+                        if np.isnan(self.neighbor_distance[g])
+                        else float(self.neighbor_distance[g])
+                    ),
+                }
+            )
+        return {
+            "method": result.method,
+            "k": result.k,
+            "criterion": result.criterion,
+            "score": result.score,
+            "n_prompts": self.total,
+            "n_unique": int(len(self.labels)),
+            "n_clusters": int((self.cluster_ids != -1).sum()),
+            "n_noise": self.size(-1) if -1 in self._group else 0,
+            "n_ambiguous": int(len(self.ambiguous)),
+            "clusters": clusters,
+        }
+
+    def write_json(
+        self, path: Path, result: ClusterResult, meta: dict[int, dict[str, str]]
+    ) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_dict(result, meta), indent=2), encoding="utf-8")
+        print(f"Wrote cluster statistics to {path}")
 
-    for lbl in sorted(set(labels)):
-        if lbl == -1:
-            # Noise (DBSCAN) – skip LLM call.
-            out[lbl] = {
-                "name": "Noise / Outlier",
-                "description": "Prompts that do not cleanly belong to any cluster.",
-            }
-            continue
 
-        # Pick a handful of example prompts to send to the model.
-        examples_series = df.loc[labels == lbl, "prompt"].sample(
-            min(max_examples, (labels == lbl).sum()), random_state=42
+# ---------------------------------------------------------------------------
+# Incremental updates
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class ClusterState:
+    """Everything a later ``--update`` run needs from a previous run.
+
+    Centroids, cumulative sizes and spread (mean distance to the centroid) per
+    cluster, the cluster names / descriptions, and the content key (see
+    :func:`_content_key`) of every prompt already assigned, so known prompts
+    are never re‑assigned.  Saved as a single ``.npz`` file.
+    """
+
+    namespace: str
+    cluster_ids: np.ndarray
+    centroids: np.ndarray
+    sizes: np.ndarray
+    spread: np.ndarray
+    keys: np.ndarray
+    key_labels: np.ndarray
+    meta: dict[int, dict[str, str]] = field(default_factory=dict)
+
+    @classmethod
+    def from_stats(
+        cls,
+        stats: ClusterStats,
+        prompts: Sequence[str],
+        meta: dict[int, dict[str, str]],
+        namespace: str,
+    ) -> ClusterState:
+        """State after a full run; noise rows are left out (retried on update)."""
+
+        real = stats.cluster_ids != -1
+        assigned = np.flatnonzero(stats.labels != -1)
+        return cls(
+            namespace=namespace,
+            cluster_ids=stats.cluster_ids[real],
+            centroids=stats.centroids[real],
+            sizes=stats.sizes[real].astype(np.float64),
+            spread=stats.mean_distance[real],
+            keys=np.array([_content_key(prompts[i]) for i in assigned], dtype="S16"),
+            key_labels=stats.labels[assigned].astype(np.int64),
+            meta={int(lbl): meta[int(lbl)] for lbl in stats.cluster_ids[real]},
+        )
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp,
+            namespace=self.namespace,
+            cluster_ids=self.cluster_ids,
+            centroids=self.centroids,
+            sizes=self.sizes,
+            spread=self.spread,
+            keys=self.keys,
+            key_labels=self.key_labels,
+            meta=json.dumps({str(k): v for k, v in self.meta.items()}),
         )
-        examples = examples_series.tolist()
-
-        user_content = (
-            "The following text snippets are all part of the same semantic cluster.\n"
-            "Please propose \n"
-            "1. A very short *title* for the cluster (≤ 4 words).\n"
-            "2. A concise 2–3 sentence *description* that explains the common theme.\n\n"
-            "Answer **strictly** as valid JSON with the keys 'name' and 'description'.\n\n"
-            "Snippets:\n"
+        os.replace(tmp, path)
+        print(f"Saved cluster state to {path}")
+
+    @classmethod
+    def load(cls, path: Path) -> ClusterState:
+        if not path.exists():
+            raise SystemExit(f"--update needs the state of a previous run, but {path} is missing.")
+        with np.load(path) as data:
+            return cls(
+                namespace=str(data["namespace"]),
+                cluster_ids=data["cluster_ids"],
+                centroids=data["centroids"],
+                sizes=data["sizes"],
+                spread=data["spread"],
+                keys=data["keys"],
+                key_labels=data["key_labels"],
+                meta={int(k): v for k, v in json.loads(str(data["meta"])).items()},
+            )
+
+    def update(
+        self,
+        matrix: np.ndarray,
+        prompts: Sequence[str],
+        weights: np.ndarray,
+        *,
+        threshold: float = 2.0,
+        min_size: int = 3,
+        relabel_fraction: float = 0.25,
+    ) -> tuple[ClusterResult, list[int]]:
+        """Assign *prompts* (rows of *matrix*) and return the result and the clusters to relabel.
+
+        Known prompts keep their label and only add to the cluster size.  A new
+        prompt joins its nearest centroid when it lies within *threshold* times
+        that cluster's spread, moving the centroid (running weighted mean).  The
+        others are grouped with a leader pass (same radius rule, using the
+        median spread); groups that weigh at least *min_size* become new
+        clusters and the rest is labelled noise (``-1``) and left out of the
+        state, so it is retried next time.
+
+        New clusters are always returned for labelling; a grown cluster only
+        when its new prompts weigh at least *relabel_fraction* of its previous
+        size, since a handful of additions rarely changes what it is about and
+        the current input alone would be a poor sample of it.
+        """
+
+        keys = np.array([_content_key(t) for t in prompts], dtype="S16")
+        known = dict(zip(self.keys.tolist(), self.key_labels.tolist()))
+        position = {int(lbl): i for i, lbl in enumerate(self.cluster_ids)}
+        labels = np.full(len(keys), -1, dtype=np.int64)
+        is_new = np.ones(len(keys), dtype=bool)
+        for i, key in enumerate(keys.tolist()):
+            lbl = known.get(key)
+            if lbl is not None:
+                labels[i] = lbl
+                is_new[i] = False
+                self.sizes[position[lbl]] += weights[i]
+
+        new_rows = np.flatnonzero(is_new)
+        changed: set[int] = set()
+        grown = 0
+        outliers: list[int] = []
+        centroids = self.centroids.astype(np.float64)
+        sq = (centroids**2).sum(1)
+        # A state without clusters (e.g. an all‑noise DBSCAN run) has nothing
+        # to join: every new prompt goes straight to the leader pass.
+        chunks = range(0, len(new_rows), 8192) if len(self.cluster_ids) else ()
+        if not len(self.cluster_ids):
+            outliers.extend(new_rows.tolist())
+        for start in chunks:
+            rows = new_rows[start : start + 8192]
+            chunk = np.asarray(matrix[rows], dtype=np.float64)
+            dist = np.sqrt(
+                np.maximum((chunk**2).sum(1)[:, None] - 2 * chunk @ centroids.T + sq[None, :], 0)
+            )
+            nearest = dist.argmin(axis=1)
+            within = dist[np.arange(len(rows)), nearest] <= threshold * self.spread[nearest]
+            outliers.extend(rows[~within].tolist())
+            labels[rows[within]] = self.cluster_ids[nearest[within]]
+
+        # Running weighted means for the clusters that received new prompts.
+        joined = new_rows[labels[new_rows] != -1]
+        for lbl in np.unique(labels[joined]).tolist():
+            g = position[lbl]
+            rows = joined[labels[joined] == lbl]
+            w = weights[rows]
+            members = np.asarray(matrix[rows], dtype=np.float64)
+            dist = np.linalg.norm(members - self.centroids[g], axis=1)
+            total = self.sizes[g] + w.sum()
+            if w.sum() >= relabel_fraction * self.sizes[g]:
+                changed.add(lbl)
+            self.spread[g] = (self.spread[g] * self.sizes[g] + (dist * w).sum()) / total
+            self.centroids[g] = (self.centroids[g] * self.sizes[g] + w @ members) / total
+            self.sizes[g] = total
+            grown += 1
+
+        spawned = self._spawn(matrix, outliers, weights, labels, threshold, min_size)
+        changed.update(spawned)
+
+        self.keys = np.concatenate([self.keys, keys[is_new & (labels != -1)]])
+        self.key_labels = np.concatenate([self.key_labels, labels[is_new & (labels != -1)]])
+        print(
+            f"Update: {int((~is_new).sum())} known prompt(s), {len(new_rows)} new; "
+            f"{grown} cluster(s) grew ({len(changed) - len(spawned)} to be renamed), "
+            f"{len(spawned)} new cluster(s), "
+            f"{int((labels == -1).sum())} left unassigned.",
+            flush=True,
         )
-        user_content += "\n".join(f"- {t}" for t in examples)
-
-        messages = [
-            {
-                "role": "system",
-                "content": "You are an expert analyst, competent in summarising text clusters succinctly.",
-            },
-            {"role": "user", "content": user_content},
-        ]
+        result = ClusterResult(method="update", labels=labels, k=len(self.cluster_ids))
+        return result, sorted(changed)
+
+    @staticmethod
+    def _outlier_scale(matrix: np.ndarray, outliers: list[int], k: int) -> float:
+        """Spread‑like scale of *outliers* from their *k*‑th nearest neighbours.
+
+        Stands in for the cluster spread when the state has no clusters yet –
+        the same k‑distance idea DBSCAN's *eps* heuristic uses.  Two points of
+        one cluster lie about √2 times their distance to its centroid apart, so
+        the median k‑distance (over at most 2,000 sampled rows) is scaled down
+        by √2.
+        """
+
+        from sklearn.neighbors import NearestNeighbors  # type: ignore  # lazy import
+
+        rng = np.random.default_rng(42)
+        sample = np.sort(rng.choice(outliers, size=min(len(outliers), 2000), replace=False))
+        if len(sample) < 2:
+            return np.inf
+        points = np.asarray(matrix[sample], dtype=np.float64)
+        neigh = NearestNeighbors(n_neighbors=min(k + 1, len(sample))).fit(points)
+        distances, _ = neigh.kneighbors(points)
+        return float(np.median(distances[:, -1])) / np.sqrt(2)
+
+    def _spawn(
+        self,
+        matrix: np.ndarray,
+        outliers: list[int],
+        weights: np.ndarray,
+        labels: np.ndarray,
+        threshold: float,
+        min_size: int,
+    ) -> list[int]:
+        """Leader‑cluster *outliers*; add groups weighing ≥ *min_size* to the state."""
+
+        if not outliers:
+            return []
+        if len(self.spread):
+            radius = threshold * float(np.median(self.spread))
+        else:
+            radius = threshold * self._outlier_scale(matrix, outliers, min_size)
+        leaders: list[np.ndarray] = []
+        groups: list[list[int]] = []
+        for row in outliers:
+            vec = np.asarray(matrix[row], dtype=np.float64)
+            if leaders:
+                dist = np.linalg.norm(np.asarray(leaders) - vec, axis=1)
+                g = int(dist.argmin())
+                if dist[g] <= radius:
+                    groups[g].append(row)
+                    continue
+            leaders.append(vec)
+            groups.append([row])
+
+        spawned = []
+        next_id = int(self.cluster_ids.max()) + 1 if len(self.cluster_ids) else 0
+        for rows in groups:
+            w = weights[rows]
+            if w.sum() < min_size:
+                continue
+            members = np.asarray(matrix[rows], dtype=np.float64)
+            centroid = w @ members / w.sum()
+            labels[rows] = next_id
+            self.cluster_ids = np.append(self.cluster_ids, next_id)
+            self.centroids = np.vstack([self.centroids, centroid.astype(self.centroids.dtype)])
+            self.sizes = np.append(self.sizes, w.sum())
+            self.spread = np.append(
+                self.spread, (np.linalg.norm(members - centroid, axis=1) * w).sum() / w.sum()
+            )
+            spawned.append(next_id)
+            next_id += 1
+        return spawned
 
+
+# ---------------------------------------------------------------------------
+# Cluster labelling helpers (LLM)
+# ---------------------------------------------------------------------------
+
+
+def _label_messages(examples: Sequence[str]) -> list[dict[str, str]]:
+    """Chat messages asking for a name & description of a cluster with *examples*."""
+
+    user_content = (
+        "The following text snippets are all part of the same semantic cluster.\n"
+        "Please propose \n"
+        "1. A very short *title* for the cluster (≤ 4 words).\n"
+        "2. A concise 2–3 sentence *description* that explains the common theme.\n\n"
+        "Answer **strictly** as valid JSON with the keys 'name' and 'description'.\n\n"
+        "Snippets:\n"
+    )
+    user_content += "\n".join(f"- {t}" for t in examples)
+
+    return [
+        {
+            "role": "system",
+            "content": "You are an expert analyst, competent in summarising text clusters succinctly.",
+        },
+        {"role": "user", "content": user_content},
+    ]
+
+
+def _request_label(
+    client, chat_model: str, messages: list[dict[str, str]], *, timeout: float, retries: int
+) -> dict[str, str]:
+    """Ask *chat_model* for one cluster label, retrying with jittered backoff.
+
+    Every attempt is bounded by *timeout* seconds.  Network errors, timeouts
+    and unparsable replies are retried up to *retries* times; the last error
+    is re‑raised.
+    """
+
+    for attempt in range(retries + 1):
         try:
-            resp = client.chat.completions.create(model=chat_model, messages=messages)
+            resp = client.chat.completions.create(
+                model=chat_model, messages=messages, timeout=timeout
+            )
+            PROFILER.count("chat_requests")
+            PROFILER.count(
+                "chat_tokens",
+                _usage_tokens(resp, sum(_estimate_tokens(m["content"]) for m in messages)),
+            )
             reply = resp.choices[0].message.content.strip()
 
             # Extract the JSON object even if the assistant wrapped it in markdown
@@ -313,15 +2732,165 @@ def label_clusters(
             json_str = reply_clean[m_start : m_end + 1]
             data = json.loads(json_str)  # type: ignore[arg-type]
 
-            out[lbl] = {
+            return {
                 "name": str(data.get("name", "Unnamed"))[:60],
                 "description": str(data.get("description", "")).strip(),
             }
-        except Exception as exc:  # pragma: no cover – network / runtime errors.
-            print(f"⚠️  Failed to label cluster {lbl}: {exc}", file=sys.stderr)
-            out[lbl] = {"name": f"Cluster {lbl}", "description": "<LLM call failed>"}
+        except Exception:  # pragma: no cover – network / runtime errors.
+            PROFILER.count("chat_retries")
+            if attempt == retries:
+                raise
+            # Full jitter keeps concurrent retries from hitting the API in lockstep.
+            time.sleep(random.uniform(0, min(2**attempt, 30)))
+
+    raise AssertionError("unreachable")  # pragma: no cover
+
+
+class LabelCache:
+    """Persistent ``fingerprint -> {"name", "description"}`` store for cluster labels.
+
+    The fingerprint (see :meth:`key`) covers the chat model and the exact
+    messages – prompt template plus the sorted example set – so a cluster is
+    only sent to the LLM again when something that could change its label
+    changed.  Hits and misses are counted for the report.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict[str, dict[str, str]] = {}
+        if path.exists():
+            try:
+                self._entries = json.loads(path.read_text())
+            except json.JSONDecodeError:  # pragma: no cover – unlikely.
+                print("⚠️  Label cache is not valid JSON – ignoring.", file=sys.stderr)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(chat_model: str, messages: list[dict[str, str]]) -> str:
+        payload = json.dumps({"model": chat_model, "messages": messages}, sort_keys=True)
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> dict[str, str] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        PROFILER.count("label_cache_hits" if entry is not None else "label_cache_misses")
+        return entry
+
+    def put(self, key: str, value: dict[str, str]) -> None:
+        with self._lock:
+            self._entries[key] = value
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with self._lock:
+            tmp.write_text(json.dumps(self._entries, ensure_ascii=False))
+        os.replace(tmp, self.path)
+
+
+def label_clusters(
+    df: pd.DataFrame,
+    stats: ClusterStats,
+    chat_model: str,
+    max_examples: int = 12,
+    *,
+    concurrency: int = 8,
+    timeout: float = 60.0,
+    retries: int = 3,
+    cache: LabelCache | None = None,
+    clusters: Sequence[int] | None = None,
+) -> dict[int, dict[str, str]]:
+    """Generate a name & description for each cluster label via ChatGPT.
+
+    The model sees the *max_examples* prompts closest to each centroid (from
+    *stats*), which describe a cluster better than a random sample.  Up to
+    *concurrency* clusters are labelled at the same time on a thread pool;
+    each request is bounded by *timeout* and retried *retries* times (see
+    :func:`_request_label`).  A cluster whose labelling fails gets a generic
+    name without holding up the others.  Clusters found in *cache* (same chat
+    model, template and example set) are not sent at all; new labels are
+    added to it and the cache is saved.  Pass *clusters* to label only those
+    labels instead of every cluster in *stats*.
+
+    Returns a mapping ``label -> {"name": str, "description": str}``.  With
+    ``chat_model="none"`` no request is made and generic names are returned.
+    """
+
+    cluster_ids = stats.cluster_ids.tolist() if clusters is None else list(clusters)
+    if chat_model == "none":
+        return {
+            lbl: {"name": f"Cluster {lbl}", "description": "<LLM labelling disabled>"}
+            for lbl in cluster_ids
+        }
+
+    out: dict[int, dict[str, str]] = {}
+    requests: dict[int, list[dict[str, str]]] = {}
+
+    prompts = df["prompt"].to_numpy()
+
+    for lbl in cluster_ids:
+        if lbl == -1:
+            # Noise (DBSCAN) – skip LLM call.
+            out[lbl] = {
+                "name": "Noise / Outlier",
+                "description": "Prompts that do not cleanly belong to any cluster.",
+            }
+            continue
+
+        # The most representative prompts – sorted so the cache fingerprint
+        # only depends on the example *set*.
+        nearest = prompts[stats.nearest(lbl, max_examples)]
+        messages = _label_messages(sorted(nearest.tolist()))
+
+        cached = cache.get(LabelCache.key(chat_model, messages)) if cache else None
+        if cached is not None:
+            out[lbl] = cached
+        else:
+            requests[lbl] = messages
 
-    return out
+    if cache is not None:
+        print(f"Label cache: {cache.hits} hit(s), {cache.misses} miss(es).", flush=True)
+    if not requests:
+        return dict(sorted(out.items()))
+
+    openai = _lazy_import_openai()
+    # _request_label retries itself; the SDK's own retries would stack on top.
+    client = openai.OpenAI(max_retries=0)
+
+    with ThreadPoolExecutor(max(1, concurrency)) as pool:
+        futures = {
+            # A context copy per request keeps the counters on the calling stage.
+            pool.submit(
+                contextvars.copy_context().run,
+                _request_label,
+                client,
+                chat_model,
+                messages,
+                timeout=timeout,
+                retries=retries,
+            ): lbl
+            for lbl, messages in requests.items()
+        }
+        for future in as_completed(futures):
+            lbl = futures[future]
+            try:
+                out[lbl] = future.result()
+            except Exception as exc:  # pragma: no cover – network / runtime errors.
+                print(f"⚠️  Failed to label cluster {lbl}: {exc}", file=sys.stderr)
+                out[lbl] = {"name": f"Cluster {lbl}", "description": "<LLM call failed>"}
+                continue
+            if cache is not None:
+                cache.put(LabelCache.key(chat_model, requests[lbl]), out[lbl])
+
+    if cache is not None:
+        cache.save()
+    return dict(sorted(out.items()))
 
 
 # ---------------------------------------------------------------------------
@@ -331,17 +2900,19 @@ def label_clusters(
 
 def generate_markdown_report(
     df: pd.DataFrame,
-    labels: np.ndarray,
+    result: ClusterResult,
     meta: dict[int, dict[str, str]],
-    outputs: dict[str, Any],
     path_md: Path,
+    stats: ClusterStats,
+    label_cache: LabelCache | None = None,
 ):
     """Write a self‑contained Markdown analysis to *path_md*."""
 
     path_md.parent.mkdir(parents=True, exist_ok=True)
 
-    cluster_ids = sorted(set(labels))
-    counts = {lbl: int((labels == lbl).sum()) for lbl in cluster_ids}
+    cluster_ids = stats.cluster_ids.tolist()
+    counts = {lbl: stats.size(lbl) for lbl in cluster_ids}
+    prompts = df["prompt"].to_numpy()
 
     lines: list[str] = []
 
@@ -349,22 +2920,33 @@ def generate_markdown_report(
     lines.append(f"Generated by `cluster_prompts.py` – {pd.Timestamp.now()}\n")
 
     # High‑level stats
-    total = len(labels)
+    total = stats.total
     num_clusters = len(cluster_ids) - (1 if -1 in cluster_ids else 0)
     lines.append("\n## Overview\n")
     lines.append(f"* Total prompts: **{total}**")
-    lines.append(f"* Clustering method: **{outputs['method']}**")
-    if outputs.get("k"):
-        lines.append(f"* k (K‑Means): **{outputs['k']}**")
-        lines.append(f"* Silhouette score: **{outputs['silhouette']:.3f}**")
+    if len(stats.labels) != total:
+        lines.append(f"* Distinct prompts: **{len(stats.labels)}**")
+    lines.append(f"* Clustering method: **{result.method}**")
+    if result.k:
+        lines.append(f"* k (K‑Means): **{result.k}**")
+    if result.score is not None:
+        lines.append(f"* {result.criterion} score: **{result.score:.3f}**")
+    if label_cache is not None:
+        lines.append(
+            f"* Label cache: **{label_cache.hits} hit(s) / {label_cache.misses} miss(es)**"
+        )
     lines.append(f"* Final clusters (excluding noise): **{num_clusters}**\n")
 
     # Summary table
-    lines.append("\n| label | name | #prompts | description |")
-    lines.append("|-------|------|---------:|-------------|")
+    lines.append("\n| label | name | #prompts | spread | nearest | description |")
+    lines.append("|-------|------|---------:|-------:|--------:|-------------|")
     for lbl in cluster_ids:
         meta_lbl = meta[lbl]
-        lines.append(f"| {lbl} | {meta_lbl['name']} | {counts[lbl]} | {meta_lbl['description']} |")
+        nearest = stats.nearest_cluster(lbl) if lbl != -1 else None
+        lines.append(
+            f"| {lbl} | {meta_lbl['name']} | {counts[lbl]} | {stats.spread(lbl):.3f} "
+            f"| {'–' if nearest is None else nearest} | {meta_lbl['description']} |"
+        )
 
     # Detailed section per cluster
     for lbl in cluster_ids:
@@ -373,38 +2955,210 @@ def generate_markdown_report(
         lines.append(f"### Cluster {lbl}: {meta_lbl['name']} ({counts[lbl]} prompts)\n")
         lines.append(f"{meta_lbl['description']}\n")
 
-        # Show a handful of illustrative prompts.
-        sample_n = min(5, counts[lbl])
-        examples = df.loc[labels == lbl, "prompt"].sample(sample_n, random_state=42).tolist()
-        lines.append("\nExamples:\n")
-        lines.extend([f"* {t}" for t in examples])
+        # Most representative prompts first, then the least typical members.
+        lines.append("\nExamples (closest to the cluster centre):\n")
+        lines.extend([f"* {t}" for t in prompts[stats.nearest(lbl, 5)]])
+        if stats.n_unique(lbl) > 5:
+            lines.append("\nEdge cases (farthest from the cluster centre):\n")
+            lines.extend([f"* {t}" for t in prompts[stats.farthest(lbl, 3)]])
 
     # Outliers / ambiguous prompts, if any.
     if -1 in cluster_ids:
         lines.append("\n---\n")
         lines.append(f"### Noise / outliers ({counts[-1]} prompts)\n")
-        examples = (
-            df.loc[labels == -1, "prompt"].sample(min(10, counts[-1]), random_state=42).tolist()
-        )
-        lines.extend([f"* {t}" for t in examples])
+        lines.extend([f"* {t}" for t in prompts[stats.farthest(-1, 10)]])
 
     # Optional ambiguous set (for kmeans)
-    ambiguous = outputs.get("ambiguous", [])
-    if ambiguous:
+    if len(stats.ambiguous):
         lines.append("\n---\n")
-        lines.append(f"### Potentially ambiguous prompts ({len(ambiguous)})\n")
-        lines.extend([f"* {t}" for t in ambiguous])
+        lines.append(f"### Potentially ambiguous prompts ({len(stats.ambiguous)})\n")
+        lines.extend([f"* {t}" for t in prompts[stats.ambiguous]])
 
     # Plot references
     lines.append("\n---\n")
     lines.append("## Plots\n")
     lines.append(
-        "The directory `plots/` contains a bar chart of the cluster sizes and a t‑SNE scatter plot coloured by cluster.\n"
+        "The directory `plots/` contains a bar chart of the cluster sizes and a 2‑D projection (t‑SNE, PCA or UMAP) coloured by cluster.\n"
     )
 
     path_md.write_text("\n".join(lines))
 
 
+def append_profile_report(path_md: Path, summary: list[dict[str, Any]]) -> None:
+    """Append the :meth:`Profiler.summary` rows to the report at *path_md*."""
+
+    def total(counters: dict[str, float], suffix: str) -> float:
+        return sum(v for k, v in counters.items() if k.endswith(suffix))
+
+    lines = ["\n---\n", "## Profile\n"]
+    lines.append("Nested stages (e.g. `kmeans fit` inside `clustering`) are included in")
+    lines.append("their parent's time; see the trace file for the timeline.  *Peak growth* is")
+    lines.append("how far a stage raised the process memory high‑water mark (0 when it stayed")
+    lines.append("below an earlier peak); *process peak* is that mark when the stage ended.\n")
+    lines.append(
+        "| stage | calls | wall (s) | CPU (s) | peak growth (MB) | process peak (MB) "
+        "| API requests | tokens | cache hit rate |"
+    )
+    lines.append(
+        "|-------|------:|---------:|--------:|-----------------:|------------------:"
+        "|-------------:|-------:|---------------:|"
+    )
+    for row in summary:
+        counters = row.get("counters", {})
+        hits, misses = total(counters, "_cache_hits"), total(counters, "_cache_misses")
+        rss, growth = row.get("peak_rss_mb"), row.get("rss_growth_mb")
+        lines.append(
+            f"| {row['stage']} | {row['calls']} | {row['wall_s']:.2f} | {row['cpu_s']:.2f} "
+            f"| {'–' if growth is None else f'{growth:.0f}'} "
+            f"| {'–' if rss is None else f'{rss:.0f}'} "
+            f"| {total(counters, '_requests'):.0f} | {total(counters, '_tokens'):.0f} "
+            f"| {f'{hits / (hits + misses):.0%}' if hits + misses else '–'} |"
+        )
+
+    with path_md.open("a", encoding="utf-8") as fh:
+        fh.write("\n" + "\n".join(lines) + "\n")
+
+
+# ---------------------------------------------------------------------------
+# 2‑D projection
+# ---------------------------------------------------------------------------
+
+
+PROJECTIONS = ("auto", "tsne", "tsne-sample", "pca", "umap")
+# Above this many rows ``--projection auto`` switches from full to sampled t‑SNE.
+TSNE_MAX_ROWS = 20_000
+
+
+def _reduce(matrix: np.ndarray, n_components: int = 50) -> np.ndarray:
+    """Randomised truncated SVD – cheap pre‑reduction before neighbour searches."""
+
+    from sklearn.decomposition import TruncatedSVD  # type: ignore – heavy, lazy import.
+
+    n_components = min(n_components, matrix.shape[1] - 1, len(matrix) - 1)
+    svd = TruncatedSVD(n_components=n_components, algorithm="randomized", random_state=42)
+    return svd.fit_transform(matrix).astype(np.float32)
+
+
+def _tsne(matrix: np.ndarray) -> np.ndarray:
+    from sklearn.manifold import TSNE  # type: ignore – heavy, lazy import.
+
+    tsne = TSNE(
+        n_components=2, perplexity=min(30, len(matrix) // 3), random_state=42, init="random"
+    )
+    return tsne.fit_transform(matrix)
+
+
+def _tsne_sample(matrix: np.ndarray, labels: np.ndarray, sample_size: int) -> np.ndarray:
+    """t‑SNE on a stratified sample; the other rows are placed out of sample.
+
+    Every remaining row lands at the inverse‑distance weighted mean of the 2‑D
+    positions of its 5 nearest sampled neighbours (in the SVD‑reduced space).
+    """
+
+    from sklearn.neighbors import NearestNeighbors  # type: ignore  # lazy import
+
+    reduced = _reduce(matrix)
+    sample = _stratified_sample(labels, sample_size)
+    xy = np.empty((len(matrix), 2), dtype=np.float32)
+    xy[sample] = _tsne(reduced[sample])
+
+    rest = np.setdiff1d(np.arange(len(matrix)), sample, assume_unique=True)
+    if len(rest):
+        neigh = NearestNeighbors(n_neighbors=min(5, len(sample))).fit(reduced[sample])
+        dist, nearest = neigh.kneighbors(reduced[rest])
+        weight = 1.0 / (dist + 1e-9)
+        xy[rest] = (weight[..., None] * xy[sample][nearest]).sum(1) / weight.sum(1, keepdims=True)
+    return xy
+
+
+def _umap(matrix: np.ndarray) -> np.ndarray:
+    """UMAP on the SVD‑reduced matrix.
+
+    Without ``umap-learn`` installed this falls back to the spectral embedding
+    of the k‑nearest‑neighbour graph – the layout UMAP itself starts from.
+    """
+
+    reduced = _reduce(matrix)
+    try:
+        import umap  # type: ignore
+    except ImportError:
+        from sklearn.manifold import SpectralEmbedding  # type: ignore – heavy, lazy import.
+
+        print("umap-learn not installed – using a spectral k‑NN graph layout.", flush=True)
+        return SpectralEmbedding(
+            n_components=2,
+            affinity="nearest_neighbors",
+            n_neighbors=min(15, len(matrix) - 1),
+            random_state=42,
+        ).fit_transform(reduced)
+    return umap.UMAP(n_components=2, random_state=42).fit_transform(reduced)
+
+
+def project_2d(
+    matrix: np.ndarray,
+    labels: np.ndarray,
+    method: str = "auto",
+    *,
+    sample_size: int = 10_000,
+    cache_dir: Path | None = None,
+) -> tuple[np.ndarray, str]:
+    """Return ``(xy, method)`` – 2‑D coordinates of every row and the method used.
+
+    ``pca`` is instant, ``umap`` is approximate but scales well, ``tsne`` is
+    exact t‑SNE on every row and ``tsne-sample`` runs t‑SNE on a stratified
+    sample of *sample_size* rows.  ``auto`` picks ``tsne`` up to
+    :data:`TSNE_MAX_ROWS` rows and ``tsne-sample`` above.
+
+    With *cache_dir* the coordinates are saved under a key derived from the
+    matrix fingerprint (plus the labels, for the label‑stratified sample), so
+    re‑rendering the plots skips the projection.  Only the latest projection
+    per method is kept.
+    """
+
+    if method == "auto":
+        method = "tsne" if len(matrix) <= TSNE_MAX_ROWS else "tsne-sample"
+
+    path = None
+    if cache_dir is not None:
+        digest = hashlib.blake2b(_matrix_fingerprint(matrix).encode("utf-8"), digest_size=16)
+        if method == "tsne-sample":
+            digest.update(f"{sample_size}".encode("utf-8"))
+            digest.update(np.ascontiguousarray(labels, dtype=np.int64).tobytes())
+        path = cache_dir / f"{method}-{digest.hexdigest()}.npy"
+        if path.exists():
+            print(f"Reusing 2‑D projection {path}.", flush=True)
+            return np.load(path), method
+
+    if method == "pca":
+        from sklearn.decomposition import PCA  # type: ignore – heavy, lazy import.
+
+        xy = PCA(n_components=2, random_state=42).fit_transform(matrix)
+    elif method == "umap":
+        xy = _umap(matrix)
+    elif method == "tsne-sample":
+        xy = _tsne_sample(matrix, labels, sample_size)
+    else:
+        xy = _tsne(matrix)
+
+    xy = np.asarray(xy, dtype=np.float32)
+    if path is not None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npy")
+        np.save(tmp, xy)
+        os.replace(tmp, path)
+        # 32 hex digits, so ``tsne`` does not match ``tsne-sample-…`` files.
+        _prune_stale(path, f"{method}-{'?' * 32}.npy")
+    return xy, method
+
+
+def _project_shared(
+    handle: tuple[str, int, tuple[int, ...]], labels: np.ndarray, method: str, **kwargs
+) -> tuple[np.ndarray, str]:
+    """Process‑pool worker: :func:`project_2d` on a matrix shared via :func:`_shared_matrix`."""
+
+    return project_2d(_open_shared_matrix(handle), labels, method, **kwargs)
+
+
 # ---------------------------------------------------------------------------
 # Plotting helpers
 # ---------------------------------------------------------------------------
@@ -412,21 +3166,33 @@ def generate_markdown_report(
 
 def create_plots(
     matrix: np.ndarray,
-    labels: np.ndarray,
+    result: ClusterResult,
+    stats: ClusterStats,
     for_devs: pd.Series | None,
     plots_dir: Path,
+    *,
+    projection: str = "auto",
+    projection_sample: int = 10_000,
+    cache_dir: Path | None = None,
+    projected: tuple[np.ndarray, str] | None = None,
 ):
-    """Generate cluster size and t‑SNE plots."""
+    """Generate cluster size, k‑selection and 2‑D projection plots.
 
+    The projection is chosen with *projection* (see :func:`project_2d`) unless
+    already computed and passed as *projected* ``(xy, method)``.
+    """
+
+    import matplotlib
+
+    matplotlib.use("Agg")  # Files only – and safe off the main thread.
     import matplotlib.pyplot as plt  # type: ignore – heavy, lazy import.
-    from sklearn.manifold import TSNE  # type: ignore – heavy, lazy import.
 
     plots_dir.mkdir(parents=True, exist_ok=True)
+    labels = result.labels
 
     # Bar chart with cluster sizes
-    unique, counts = np.unique(labels, return_counts=True)
-    order = np.argsort(-counts)  # descending
-    unique, counts = unique[order], counts[order]
+    order = np.argsort(-stats.sizes)  # descending
+    unique, counts = stats.cluster_ids[order], stats.sizes[order]
 
     plt.figure(figsize=(8, 4))
     plt.bar([str(u) for u in unique], counts, color="steelblue")
@@ -438,15 +3204,29 @@ def create_plots(
     plt.savefig(bar_path, dpi=150)
     plt.close()
 
-    # t‑SNE scatter
-    tsne = TSNE(
-        n_components=2, perplexity=min(30, len(matrix) // 3), random_state=42, init="random"
+    # Score per candidate k, straight from the sweep diagnostics.
+    if result.diagnostics:
+        ks = [d["k"] for d in result.diagnostics]
+        plt.figure(figsize=(6, 4))
+        plt.plot(ks, [d["score"] for d in result.diagnostics], marker="o", color="steelblue")
+        plt.axvline(result.k, color="grey", linestyle="--", linewidth=1)
+        plt.xlabel("k")
+        plt.ylabel(f"{result.criterion} score")
+        plt.title("k selection")
+        plt.tight_layout()
+        plt.savefig(plots_dir / "k_selection.png", dpi=150)
+        plt.close()
+
+    # 2‑D scatter
+    xy, method = projected or project_2d(
+        matrix, labels, projection, sample_size=projection_sample, cache_dir=cache_dir
     )
-    xy = tsne.fit_transform(matrix)
+    name = "tsne" if method.startswith("tsne") else method
+    titles = {"tsne": "t‑SNE", "tsne-sample": "t‑SNE (sampled)", "pca": "PCA", "umap": "UMAP"}
 
     plt.figure(figsize=(7, 6))
     scatter = plt.scatter(xy[:, 0], xy[:, 1], c=labels, cmap="tab20", s=20, alpha=0.8)
-    plt.title("t‑SNE projection")
+    plt.title(f"{titles[method]} projection")
     plt.xticks([])
     plt.yticks([])
 
@@ -464,12 +3244,92 @@ def create_plots(
         )
         plt.legend(loc="best")
 
-    tsne_path = plots_dir / "tsne.png"
     plt.tight_layout()
-    plt.savefig(tsne_path, dpi=150)
+    plt.savefig(plots_dir / f"{name}.png", dpi=150)
     plt.close()
 
 
+# ---------------------------------------------------------------------------
+# Pipeline stages
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class Stage:
+    """One node of the post‑clustering pipeline.
+
+    *fn* is called with the results of *deps* as positional arguments, in
+    order.  ``process=True`` runs it in a worker process (CPU‑bound work; *fn*
+    and its arguments must be picklable), otherwise on a thread (I/O‑bound or
+    cheap work).
+    """
+
+    name: str
+    fn: Callable[..., Any]
+    deps: tuple[str, ...] = ()
+    process: bool = False
+
+
+def run_stages(stages: Sequence[Stage], max_threads: int = 4) -> dict[str, Any]:
+    """Run *stages* as soon as their dependencies are done; return their results.
+
+    Independent stages overlap – e.g. LLM labelling waits on the network while
+    the 2‑D projection runs in a worker process – so the wall time is that of
+    the longest chain rather than the sum.  Per‑stage wall times are printed as
+    stages finish, and every stage is recorded as a :data:`PROFILER` span.  The
+    first failure cancels what has not started yet and is re‑raised.
+    """
+
+    by_name = {stage.name: stage for stage in stages}
+    results: dict[str, Any] = {}
+    started: dict[Any, tuple[str, float]] = {}
+    pending = list(stages)
+    t0 = time.perf_counter()
+
+    # "spawn" – see _sweep_k; the pool is only created if a stage needs it.
+    n_process = sum(stage.process for stage in stages)
+    ctx = multiprocessing.get_context("spawn")
+    with contextlib.ExitStack() as stack:
+        threads = stack.enter_context(ThreadPoolExecutor(max_threads))
+        processes = (
+            stack.enter_context(ProcessPoolExecutor(n_process, mp_context=ctx))
+            if n_process
+            else None
+        )
+        while pending or started:
+            for stage in [s for s in pending if all(d in results for d in s.deps)]:
+                pending.remove(stage)
+                args = [results[d] for d in stage.deps]
+                if stage.process:
+                    future = processes.submit(_profiled_call, stage.name, stage.fn, *args)
+                else:
+                    future = threads.submit(
+                        PROFILER.call, stage.name, stage.fn, *args, cpu_clock=time.thread_time
+                    )
+                started[future] = (stage.name, time.perf_counter())
+            if not started:
+                missing = {d for s in pending for d in s.deps if d not in by_name}
+                raise ValueError(f"Unresolvable stage dependencies: {sorted(missing)}")
+
+            done, _ = wait(started, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, start = started.pop(future)
+                try:
+                    results[name] = future.result()
+                    if by_name[name].process:
+                        results[name], events, counters = results[name]
+                        PROFILER.merge(events, counters)
+                except BaseException:
+                    for other in started:
+                        other.cancel()
+                    raise
+                where = "process" if by_name[name].process else "thread"
+                print(f"⏱  {name}: {time.perf_counter() - start:.2f} s ({where})", flush=True)
+
+    print(f"⏱  stages total: {time.perf_counter() - t0:.2f} s", flush=True)
+    return results
+
+
 # ---------------------------------------------------------------------------
 # Main entry point
 # ---------------------------------------------------------------------------
@@ -478,66 +3338,175 @@ def create_plots(
 def main() -> None:  # noqa: D401
     args = parse_cli()
 
-    # Read CSV – require a 'prompt' column.
-    df = pd.read_csv(args.csv)
-    if "prompt" not in df.columns:
-        raise SystemExit("Input CSV must contain a 'prompt' column.")
-
-    # Keep relevant columns only for clarity.
-    df = df[[c for c in df.columns if c in {"act", "prompt", "for_devs"}]]
+    # Stream the input – one row per distinct prompt, with a 'count' column.
+    with PROFILER.stage("input"):
+        df = read_prompts(args.csv, chunk_rows=args.read_chunk_rows)
+    weights = df["count"].to_numpy(dtype=np.float64)
 
     # ---------------------------------------------------------------------
     # 1. Embeddings (may be cached)
     # ---------------------------------------------------------------------
-    embeddings_df = load_or_create_embeddings(
-        df["prompt"], cache_path=args.cache, model=args.embedding_model
+    backend = make_embedding_backend(
+        args.embedding_backend,
+        args.embedding_model,
+        args.embedding_dimensions,
+        n_threads=args.embedding_threads,
+        mode=args.embedding_mode,
+        max_in_flight=args.embedding_concurrency,
+        rpm=args.embedding_rpm,
+        tpm=args.embedding_tpm,
+        max_batch_tokens=args.batch_max_tokens,
+        max_batch_items=args.batch_max_items,
     )
+    # Mini‑batch K‑Means streams the matrix, so keep it in a temporary memory
+    # map instead of RAM; the file is deleted when the run ends.
+    spill = (
+        tempfile.NamedTemporaryFile(prefix="cluster_prompts_", suffix=".f32")
+        if args.cluster_method == "minibatch-kmeans"
+        else None
+    )
+    with PROFILER.stage("embedding"):
+        embeddings_df = load_or_create_embeddings(
+            df["prompt"],
+            cache_path=args.cache,
+            backend=backend,
+            cache_max_mb=args.cache_max_mb,
+            cache_max_age_days=args.cache_max_age_days,
+            legacy_model=args.legacy_cache_model,
+            spill=spill,
+        )
 
     # ---------------------------------------------------------------------
     # 2. Clustering
     # ---------------------------------------------------------------------
-    mat = embeddings_df.values.astype(np.float32)
+    mat = embeddings_df.to_numpy(dtype=np.float32, copy=False)
+    selector = KSelector(args.k_criterion, sample_size=args.silhouette_sample)
 
-    if args.cluster_method == "kmeans":
-        labels = cluster_kmeans(mat, k_max=args.k_max)
-    else:
-        labels = cluster_dbscan(mat, min_samples=args.dbscan_min_samples)
-
-    # Identify potentially ambiguous prompts (only meaningful for kmeans).
-    outputs: dict[str, Any] = {"method": args.cluster_method}
-    if args.cluster_method == "kmeans":
-        from sklearn.cluster import KMeans  # type: ignore – lazy
-
-        best_k = len(set(labels))
-        # Re‑fit KMeans with the chosen k to get distances.
-        kmeans = KMeans(n_clusters=best_k, random_state=42, n_init="auto").fit(mat)
-        outputs["k"] = best_k
-        # Silhouette score (again) – not super efficient but okay.
-        from sklearn.metrics import silhouette_score  # type: ignore
-
-        outputs["silhouette"] = silhouette_score(mat, labels)
-
-        distances = kmeans.transform(mat)
-        # Ambiguous if the ratio between 1st and 2nd closest centroid < 1.1
-        sorted_dist = np.sort(distances, axis=1)
-        ratio = sorted_dist[:, 0] / (sorted_dist[:, 1] + 1e-9)
-        ambiguous_mask = ratio > 0.9  # tunes threshold – close centroids.
-        outputs["ambiguous"] = df.loc[ambiguous_mask, "prompt"].tolist()
+    # --update: assign to the previous run's clusters instead of re‑clustering.
+    state = ClusterState.load(args.state) if args.update else None
+    if state is not None and state.namespace != backend.namespace:
+        raise SystemExit(
+            f"{args.state} was built with {state.namespace} embeddings, not {backend.namespace}."
+        )
 
-    # ---------------------------------------------------------------------
-    # 3. LLM naming / description
-    # ---------------------------------------------------------------------
-    meta = label_clusters(df, labels, chat_model=args.chat_model)
+    with PROFILER.stage("clustering"):
+        if state is not None:
+            result, changed = state.update(
+                mat,
+                df["prompt"].tolist(),
+                weights,
+                threshold=args.update_threshold,
+                min_size=args.update_min_size,
+                relabel_fraction=args.update_relabel_fraction,
+            )
+        elif args.cluster_method == "kmeans":
+            result = cluster_kmeans(
+                mat,
+                k_max=args.k_max,
+                selector=selector,
+                n_jobs=args.k_jobs,
+                patience=args.k_patience,
+                sample_weight=weights,
+            )
+        elif args.cluster_method == "minibatch-kmeans":
+            result = cluster_minibatch_kmeans(
+                mat,
+                k_max=args.k_max,
+                sample_size=args.k_sample_size,
+                chunk_size=args.chunk_size,
+                selector=selector,
+                sample_weight=weights,
+            )
+        else:
+            result = cluster_dbscan(
+                mat,
+                min_samples=args.dbscan_min_samples,
+                index=args.dbscan_index,
+                nprobe=args.ann_nprobe,
+                index_dir=cache_root(args.cache) / "ann" if args.cache else None,
+                sample_weight=weights,
+                check=args.dbscan_check,
+            )
+
+    # Sizes, centroids, dispersion, neighbours, noise and ambiguous rows in
+    # one pass – shared by labelling, plots, report and the JSON export.
+    with PROFILER.stage("statistics"):
+        stats = ClusterStats(mat, result.labels, result.centers, weights=weights)
 
     # ---------------------------------------------------------------------
-    # 4. Plots
+    # 3.–5. Labelling, plots and report – independent stages run concurrently
     # ---------------------------------------------------------------------
-    create_plots(mat, labels, df.get("for_devs"), args.plots_dir)
+    label_cache_path = args.label_cache or (
+        cache_root(args.cache) / "labels.json" if args.cache else None
+    )
+    label_cache = LabelCache(label_cache_path) if label_cache_path else None
+
+    def label() -> dict[int, dict[str, str]]:
+        # On --update only new and substantially grown clusters are (re)labelled.
+        refresh = None
+        if state is not None:
+            refresh = [
+                lbl for lbl in stats.cluster_ids.tolist() if lbl in changed or lbl not in state.meta
+            ]
+        meta = label_clusters(
+            df,
+            stats,
+            chat_model=args.chat_model,
+            concurrency=args.label_concurrency,
+            timeout=args.label_timeout,
+            retries=args.label_retries,
+            cache=label_cache,
+            clusters=refresh,
+        )
+        if state is not None:
+            state.meta.update({lbl: info for lbl, info in meta.items() if lbl != -1})
+            meta = {lbl: meta.get(lbl) or state.meta[lbl] for lbl in stats.cluster_ids.tolist()}
+        return meta
+
+    def plots(projected: tuple[np.ndarray, str]) -> None:
+        create_plots(mat, result, stats, df.get("for_devs"), args.plots_dir, projected=projected)
+
+    def report(meta: dict[int, dict[str, str]]) -> None:
+        generate_markdown_report(
+            df,
+            result,
+            meta,
+            path_md=args.output_md,
+            stats=stats,
+            label_cache=label_cache,
+        )
+        stats.write_json(args.stats_json, result, meta)
+        saved = state or ClusterState.from_stats(
+            stats, df["prompt"].tolist(), meta, backend.namespace
+        )
+        saved.save(args.state)
+
+    # The projection is the CPU‑heavy stage: it runs in a worker process that
+    # reads the matrix from disk while labelling waits on the LLM.
+    with _shared_matrix(mat) as handle:
+        run_stages(
+            [
+                Stage("labelling", label),
+                Stage(
+                    "projection",
+                    functools.partial(
+                        _project_shared,
+                        handle,
+                        result.labels,
+                        args.projection,
+                        sample_size=args.projection_sample,
+                        cache_dir=cache_root(args.cache) / "projections" if args.cache else None,
+                    ),
+                    process=True,
+                ),
+                Stage("plots", plots, deps=("projection",)),
+                Stage("report", report, deps=("labelling",)),
+            ]
+        )
 
-    # ---------------------------------------------------------------------
-    # 5. Markdown report
-    # ---------------------------------------------------------------------
-    generate_markdown_report(df, labels, meta, outputs, path_md=args.output_md)
+    if args.profile:
+        append_profile_report(args.output_md, PROFILER.summary())
+        PROFILER.write_trace(args.profile)
 
     print(f"✅ Done. Report written to {args.output_md} – plots in {args.plots_dir}/", flush=True)
 
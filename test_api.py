@@ -1,14 +1,26 @@
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI, AzureOpenAI
+from collections import OrderedDict, deque
+from functools import lru_cache
+import asyncio
+import hashlib
+import httpx
 import json
+import openai
+import sqlite3
+import sys
+import threading
+import time
 import traceback
 
 combined_history = []
 OPENAI_API_KEY = "1ec57c7402ed46ecbae6b09b12cb0e3c"
+AZURE_ENDPOINT = "https://appi-gpt4.openai.azure.com/"
+API_VERSION = "2025-04-01-preview"
 azure_openai = AzureOpenAI(
     # azure_ad_token_provider=token_provider,
-    azure_endpoint="https://appi-gpt4.openai.azure.com/",
+    azure_endpoint=AZURE_ENDPOINT,
     api_key=OPENAI_API_KEY,
-    api_version="2025-04-01-preview"
+    api_version=API_VERSION
 )
 
 model_descriptions = {
@@ -28,89 +40,786 @@ model_descriptions = {
             }
 
 model = "o3"
-def process_message(system_message, combined_history):
-    try:
-        msg = [system_message] + combined_history
 
-        # Pick the right Azure client (your existing logic)
+# Deployments served through the Responses API instead of Chat Completions.
+RESPONSES_API_MODELS = ["o3-pro", "codex-mini"]
+# Reasoning models reject the sampling parameters below.
+REASONING_MODELS = ['o1', 'o3-mini', 'o3', 'o3-pro', "codex-mini"]
+# Returned when a reply has neither text nor tool calls.
+NO_RESPONSE = "No response from the model."
 
-        # ─── SPECIAL CASE: o3-pro  (uses Responses API) ─────────────────────
-        if model in ["o3-pro", "codex-mini"]:
-            request_params = {
-                "input": msg,      # Responses API expects 'input'
-                "model": model,
-            }
-            response = azure_openai.responses.create(**request_params)
-
-            # ---- pull the assistant text out of the Response object -------
-            text_content = ""
-            tool_call_items = []
-
-            # The final consolidated result lives in response.output
-            # Iterate through it to collect message text and any tool calls
-            if getattr(response, "output", None):
-                for item in response.output:
-                    if getattr(item, "type", "") == "message":
-                        for part in getattr(item, "content", []):
-                            if getattr(part, "type", "") == "output_text":
-                                text_content += (part.text or "")
-                    elif getattr(item, "type", "") == "tool_call":
-                        tool_call_items.append(item)
-
-            # Return text if present
-            if text_content:
-                return text_content
-
-            # Otherwise return tool-call payload if that’s what we got
-            if tool_call_items:
-                tool_calls_serialized = json.loads(json.dumps(
-                    tool_call_items, default=lambda o: o.__dict__
-                ))
-                return [tool_calls_serialized, {}]  # second element just a stub
-
-            # Fallback
-            return "No response from the model."
-
-        # ─── EVERY OTHER MODEL: Chat-Completions (unchanged) ───────────────
+
+def _chat_params(model, msg):
+    request_params = {
+        "messages": msg,
+        "model": model,
+    }
+    if model not in REASONING_MODELS:
+        request_params["max_tokens"]   = 4096
+        request_params["top_p"]        = 0.9
+        request_params["temperature"]  = 0.7
+    return request_params
+
+
+def _parse_responses_output(response):
+    """Return text, or ``[tool_calls, {}]``, from a Responses-API result."""
+    text_content = ""
+    tool_call_items = []
+
+    # The final consolidated result lives in response.output
+    # Iterate through it to collect message text and any tool calls
+    if getattr(response, "output", None):
+        for item in response.output:
+            if getattr(item, "type", "") == "message":
+                for part in getattr(item, "content", []):
+                    if getattr(part, "type", "") == "output_text":
+                        text_content += (part.text or "")
+            elif getattr(item, "type", "") in ("tool_call", "function_call"):
+                tool_call_items.append(item)
+
+    # Return text if present
+    if text_content:
+        return text_content
+
+    # Otherwise return tool-call payload if that’s what we got
+    if tool_call_items:
+        tool_calls_serialized = json.loads(json.dumps(
+            tool_call_items, default=lambda o: o.__dict__
+        ))
+        return [tool_calls_serialized, {}]  # second element just a stub
+
+    # Fallback
+    return NO_RESPONSE
+
+
+def _parse_chat_response(response):
+    """Return text, or ``[tool_calls, message]``, from a Chat-Completions result."""
+    # ‣ Standard content / tool-call extraction (your original code)
+    if hasattr(response.choices[0].message, 'content') and response.choices[0].message.content:
+        return response.choices[0].message.content
+
+    # ``tool_calls`` is always present on the SDK object, ``None`` when unused.
+    elif getattr(response.choices[0].message, 'tool_calls', None):
+        tool_calls_serialized = json.loads(json.dumps(
+            response.choices[0].message.tool_calls,
+            default=lambda o: o.__dict__
+        ))
+        tool_info_serialized = json.loads(json.dumps(
+            response.choices[0].message,
+            default=lambda o: o.__dict__
+        ))
+        return [tool_calls_serialized, tool_info_serialized]
+
+    else:
+        return NO_RESPONSE
+
+
+def _send(model, msg, timeout=None, max_retries=None):
+    """One request to *model*; API errors propagate (see ``process_message``).
+
+    *max_retries* overrides the client's retry count (``0`` fails fast).
+    """
+    extra = {"timeout": timeout} if timeout else {}
+    client = (azure_openai if max_retries is None
+              else azure_openai.with_options(max_retries=max_retries))
+
+    # ─── SPECIAL CASE: o3-pro  (uses Responses API) ─────────────────────
+    if model in RESPONSES_API_MODELS:
         request_params = {
-            "messages": msg,
+            "input": msg,      # Responses API expects 'input'
             "model": model,
         }
-        if model not in ['o1', 'o3-mini', 'o3', 'o3-pro', "codex-mini"]:
-            request_params["max_tokens"]   = 4096
-            request_params["top_p"]        = 0.9
-            request_params["temperature"]  = 0.7
+        response = client.responses.create(**request_params, **extra)
 
+        # ---- pull the assistant text out of the Response object -------
+        return _parse_responses_output(response)
 
-        response = azure_openai.chat.completions.create(**request_params)
+    # ─── EVERY OTHER MODEL: Chat-Completions (unchanged) ───────────────
+    request_params = _chat_params(model, msg)
 
-        # ‣ Standard content / tool-call extraction (your original code)
-        if hasattr(response.choices[0].message, 'content') and response.choices[0].message.content:
-            return response.choices[0].message.content
+    response = client.chat.completions.create(**request_params, **extra)
+    return _parse_chat_response(response)
 
-        elif hasattr(response.choices[0].message, 'tool_calls'):
-            tool_calls_serialized = json.loads(json.dumps(
-                response.choices[0].message.tool_calls,
-                default=lambda o: o.__dict__
-            ))
-            tool_info_serialized = json.loads(json.dumps(
-                response.choices[0].message,
-                default=lambda o: o.__dict__
-            ))
-            return [tool_calls_serialized, tool_info_serialized]
 
+# ─── Response cache (opt-in) ───────────────────────────────────────────────
+class ResponseCache:
+    """Cache of ``process_message`` results keyed by the exact request.
+
+    Two tiers: an in-memory LRU of *max_items* entries and, with *path*, a
+    SQLite file shared across runs (CI, evaluation loops).  Entries expire
+    after *ttl* seconds.  Values are stored as JSON, so text replies,
+    Responses-API results and tool-call payloads all round-trip, and every
+    hit returns a fresh copy.  The ``NO_RESPONSE`` fallback is never stored,
+    and requests that sample (``temperature`` > 0) bypass the cache unless
+    *sampled* is set – a cached draw would otherwise be replayed for good.
+    ``stats()`` reports hits per tier, misses, skipped requests and the hit
+    rate.
+    """
+
+    def __init__(self, path=None, ttl=24 * 3600, max_items=1024, sampled=False):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.sampled = sampled
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self._memory = OrderedDict()   # key -> (expires, json payload)
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, "
+                             "model TEXT, created REAL, expires REAL, payload TEXT)")
+            self._db.commit()
+
+    @staticmethod
+    def key(model, msg, params):
+        """Canonical hash of model, messages and request parameters."""
+        canonical = json.dumps({"model": model, "messages": msg, "params": params},
+                               sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+                               default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return json.loads(entry[1])
+            self._memory.pop(key, None)
+
+            row = None
+            if self._db is not None:
+                row = self._db.execute("SELECT expires, payload FROM responses "
+                                       "WHERE key = ? AND expires > ?", (key, now)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, row[0], row[1])
+            return json.loads(row[1])
+
+    def skip(self):
+        """Count a request that bypassed the cache."""
+        with self._lock:
+            self.skipped += 1
+
+    def put(self, key, model, value, ttl=None):
+        if value == NO_RESPONSE:
+            return
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        payload = json.dumps(value, default=lambda o: o.__dict__)
+        with self._lock:
+            self._remember(key, expires, payload)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                                 (key, model, now, expires, payload))
+                self._db.commit()
+
+    def _remember(self, key, expires, payload):
+        self._memory[key] = (expires, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def purge(self):
+        """Drop expired entries from both tiers."""
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (expires, _) in self._memory.items() if expires <= now]:
+                del self._memory[key]
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+                self._db.commit()
+
+    def stats(self):
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {"hits": hits, "memory_hits": self.memory_hits, "disk_hits": self.disk_hits,
+                "misses": self.misses, "skipped": self.skipped,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_items": len(self._memory)}
+
+
+# Set by enable_response_cache(); None keeps every call uncached.
+response_cache = None
+
+
+def enable_response_cache(path="response_cache.sqlite", ttl=24 * 3600, max_items=1024,
+                          sampled=False):
+    """Turn on the response cache for ``process_message`` / ``process_messages_batch``.
+
+    With *sampled* replies to ``temperature`` > 0 requests are cached too.
+    """
+    global response_cache
+    response_cache = ResponseCache(path, ttl=ttl, max_items=max_items, sampled=sampled)
+    return response_cache
+
+
+def _cache_key(model, msg):
+    """Cache key for *msg* to *model*, or ``None`` if the reply must not be cached."""
+    # Everything besides the messages that shapes the reply.
+    params = {k: v for k, v in _chat_params(model, []).items() if k not in ("messages", "model")}
+    if params.get("temperature") and not response_cache.sampled:
+        response_cache.skip()
+        return None
+    params["api"] = "responses" if model in RESPONSES_API_MODELS else "chat"
+    return ResponseCache.key(model, msg, params)
+
+
+def _cached_send(model, msg):
+    key = _cache_key(model, msg) if response_cache is not None else None
+    if key is None:
+        return _send(model, msg)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+    response = _send(model, msg)
+    response_cache.put(key, model, response)
+    return response
+
+
+def process_message(system_message, combined_history):
+    try:
+        msg = [system_message, *combined_history]
+        return _cached_send(model, msg)
+
+    except Exception as e:
+        print(f"Unexpected {traceback.format_exc()}, {type(e)=}")
+        return str({traceback.format_exc()})
+
+
+def process_message_stream(system_message, combined_history):
+    """Streaming variant of ``process_message``.
+
+    Yields events as they arrive:
+
+    * ``{"type": "text", "delta": str}``
+    * ``{"type": "tool_call", "index": int, "id": str | None, "name": str | None,
+      "arguments": str}`` – a fragment; ``arguments`` is appended per index
+    * ``{"type": "done", "result": ..., "ttft": float | None, "elapsed": float}``
+      – last event; ``result`` has the same shape ``process_message`` returns
+      and ``ttft`` is the time-to-first-token in seconds.
+    """
+    start = time.perf_counter()
+    ttft = None
+    try:
+        msg = [system_message, *combined_history]
+
+        # ─── Responses API (o3-pro, codex-mini) ────────────────────────────
+        if model in RESPONSES_API_MODELS:
+            stream = azure_openai.responses.create(input=msg, model=model, stream=True)
+            result = NO_RESPONSE
+            for event in stream:
+                kind = getattr(event, "type", "")
+                if kind == "response.output_text.delta":
+                    ttft = ttft if ttft is not None else time.perf_counter() - start
+                    yield {"type": "text", "delta": event.delta}
+                elif kind == "response.output_item.added" and \
+                        getattr(event.item, "type", "") in ("tool_call", "function_call"):
+                    ttft = ttft if ttft is not None else time.perf_counter() - start
+                    yield {"type": "tool_call", "index": event.output_index,
+                           "id": getattr(event.item, "call_id", event.item.id),
+                           "name": getattr(event.item, "name", None), "arguments": ""}
+                elif kind == "response.function_call_arguments.delta":
+                    yield {"type": "tool_call", "index": event.output_index,
+                           "id": None, "name": None, "arguments": event.delta}
+                elif kind == "response.completed":
+                    # The completed event carries the full Response – parse it
+                    # exactly like the non-streaming path.
+                    result = _parse_responses_output(event.response)
+            yield {"type": "done", "result": result, "ttft": ttft,
+                   "elapsed": time.perf_counter() - start}
+            return
+
+        # ─── EVERY OTHER MODEL: Chat-Completions ───────────────────────────
+        stream = azure_openai.chat.completions.create(**_chat_params(model, msg), stream=True)
+        text_content = ""
+        tool_calls = {}   # index -> {"id", "type", "function": {"name", "arguments"}}
+        for chunk in stream:
+            # Azure sends content-filter chunks without choices.
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if getattr(delta, "content", None):
+                ttft = ttft if ttft is not None else time.perf_counter() - start
+                text_content += delta.content
+                yield {"type": "text", "delta": delta.content}
+            for fragment in getattr(delta, "tool_calls", None) or []:
+                ttft = ttft if ttft is not None else time.perf_counter() - start
+                call = tool_calls.setdefault(fragment.index, {
+                    "id": None, "type": "function", "function": {"name": None, "arguments": ""}
+                })
+                function = getattr(fragment, "function", None)
+                name = getattr(function, "name", None)
+                arguments = getattr(function, "arguments", None) or ""
+                call["id"] = fragment.id or call["id"]
+                call["function"]["name"] = name or call["function"]["name"]
+                call["function"]["arguments"] += arguments
+                yield {"type": "tool_call", "index": fragment.index, "id": fragment.id,
+                       "name": name, "arguments": arguments}
+
+        if text_content:
+            result = text_content
+        elif tool_calls:
+            tool_calls_serialized = [tool_calls[i] for i in sorted(tool_calls)]
+            tool_info_serialized = {"content": None, "role": "assistant",
+                                    "tool_calls": tool_calls_serialized}
+            result = [tool_calls_serialized, tool_info_serialized]
         else:
-            return "No response from the model."
+            result = NO_RESPONSE
+        yield {"type": "done", "result": result, "ttft": ttft,
+               "elapsed": time.perf_counter() - start}
+
+    except Exception as e:
+        print(f"Unexpected {traceback.format_exc()}, {type(e)=}")
+        yield {"type": "done", "result": str({traceback.format_exc()}), "ttft": ttft,
+               "elapsed": time.perf_counter() - start}
+
+
+# ─── Conversation history with a token budget ──────────────────────────────
+# Context window and the share of it kept free for the reply (reasoning models
+# also spend output tokens on reasoning, so they reserve more).
+MODEL_CAPABILITIES = {
+    "o3":              {"context": 200_000,   "reserve": 25_000},
+    "o3-mini":         {"context": 200_000,   "reserve": 25_000},
+    "o3-pro":          {"context": 200_000,   "reserve": 25_000},
+    "o1":              {"context": 200_000,   "reserve": 25_000},
+    "codex-mini":      {"context": 200_000,   "reserve": 25_000},
+    "gpt-4.1-nano":    {"context": 1_047_576, "reserve": 4_096},
+    "gpt-4.1-mini":    {"context": 1_047_576, "reserve": 4_096},
+    "gpt-4.1":         {"context": 1_047_576, "reserve": 4_096},
+    "gpt-4o":          {"context": 128_000,   "reserve": 4_096},
+    "gpt-4":           {"context": 128_000,   "reserve": 4_096},
+    "gpt-4-32k":       {"context": 32_768,    "reserve": 4_096},
+    "gpt-4.5-preview": {"context": 128_000,   "reserve": 4_096},
+    "gpt-35-turbo":    {"context": 16_385,    "reserve": 4_096},
+}
+DEFAULT_CAPABILITIES = {"context": 128_000, "reserve": 4_096}
+
+
+def token_budget(model):
+    """Prompt tokens *model* accepts once its reply reserve is set aside."""
+    caps = MODEL_CAPABILITIES.get(model, DEFAULT_CAPABILITIES)
+    return caps["context"] - caps["reserve"]
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text, model=None):
+    """Token count of *text* (tiktoken if installed, else ~3 bytes per token)."""
+    encoding = _encoding(model or "gpt-4o")
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(text.encode("utf-8")) // 3 + 1
+
+
+def message_tokens(message, model=None):
+    """Tokens of one chat message, including the per-message overhead."""
+    content = message.get("content") or ""
+    if not isinstance(content, str):
+        # Multimodal content parts – count the text parts only.
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    tokens = 4 + count_tokens(content, model)
+    if message.get("tool_calls"):
+        tokens += count_tokens(json.dumps(message["tool_calls"]), model)
+    return tokens
+
+
+def response_to_message(response):
+    """Turn a ``process_message`` return value into an assistant message."""
+    if isinstance(response, list):
+        tool_calls, info = response
+        if info.get("tool_calls"):
+            return {"role": "assistant", "content": info.get("content"),
+                    "tool_calls": info["tool_calls"]}
+        return {"role": "assistant", "content": json.dumps(tool_calls)}
+    return {"role": "assistant", "content": response}
+
+
+class ConversationStore:
+    """Conversation history that stays within a model's context window.
+
+    Messages are appended in place and their token counts are computed once,
+    so adding a turn and checking the budget never re-count the history;
+    building the request is still O(history), as the whole history is sent.
+    ``request(model)`` drops the oldest turns until the history fits
+    ``token_budget(model)``; with a *summarize* callable (see
+    ``summarize_with``) the dropped turns are folded into a running summary
+    that is sent right after the system message.  The latest message is never
+    dropped, and tool results are dropped together with the call they answer.
+    """
+
+    def __init__(self, system_message, summarize=None, count_model=None):
+        self.system_message = system_message
+        self.summarize = summarize
+        self.count_model = count_model
+        self.summary = None
+        self.total_tokens = 0
+        self._messages = deque()
+        self._tokens = deque()
+        self._fixed_tokens = message_tokens(system_message, count_model)
+
+    def __len__(self):
+        return len(self._messages)
+
+    def add(self, message):
+        tokens = message_tokens(message, self.count_model)
+        self._messages.append(message)
+        self._tokens.append(tokens)
+        self.total_tokens += tokens
+
+    def add_response(self, response):
+        self.add(response_to_message(response))
+
+    def _summary_message(self):
+        return {"role": "system",
+                "content": f"Summary of the earlier conversation:\n{self.summary}"}
+
+    def _pop(self):
+        self.total_tokens -= self._tokens.popleft()
+        return self._messages.popleft()
+
+    def fit(self, model):
+        """Trim (and summarise) the oldest turns to fit *model*; return what was dropped."""
+        budget = token_budget(model)
+        dropped = []
+        while len(self._messages) > 1 and self._fixed_tokens + self.total_tokens > budget:
+            batch = []
+            while len(self._messages) > 1 and self._fixed_tokens + self.total_tokens > budget:
+                batch.append(self._pop())
+                # A tool result without its assistant tool call is rejected by the API.
+                while len(self._messages) > 1 and self._messages[0].get("role") == "tool":
+                    batch.append(self._pop())
+            dropped.extend(batch)
+            if self.summarize is None:
+                break
+            # The new summary may push the history over budget again – repeat.
+            self.summary = self.summarize(batch, self.summary)
+            self._fixed_tokens = (message_tokens(self.system_message, self.count_model)
+                                  + message_tokens(self._summary_message(), self.count_model))
+        return dropped
+
+    def request(self, model=None):
+        """``(system_message, history)`` for ``process_message``, fitted to *model*.
+
+        *history* is a new list; changing it does not affect the store.
+        """
+        self.fit(model or globals()["model"])
+        summary = [self._summary_message()] if self.summary else []
+        return self.system_message, [*summary, *self._messages]
+
+
+def summarize_with(summary_model="gpt-4.1-mini"):
+    """A ``ConversationStore`` summariser that asks *summary_model*."""
+    def summarize(dropped, previous):
+        turns = "\n".join(f"{m.get('role')}: {m.get('content') or json.dumps(m.get('tool_calls'))}"
+                          for m in dropped)
+        msg = [
+            {"role": "system", "content": "You condense conversations. Keep facts, decisions, "
+                                          "open questions and code identifiers; be brief."},
+            {"role": "user", "content": f"Summary so far:\n{previous or '(none)'}\n\n"
+                                        f"Further turns:\n{turns}\n\nWrite the updated summary."},
+        ]
+        response = azure_openai.chat.completions.create(**_chat_params(summary_model, msg))
+        summary = _parse_chat_response(response)
+        return summary if isinstance(summary, str) else previous
+    return summarize
+
+
+# ─── Latency-aware routing ──────────────────────────────────────────────────
+# Priors behind model_descriptions: typical latency in seconds and list price
+# in USD per 1M (input, output) tokens.  Live measurements replace the latency
+# prior once a model has served a few requests.
+MODEL_PROFILES = {
+    "o3-pro":          {"latency": 90.0, "price": (20.0, 80.0)},
+    "o3":              {"latency": 20.0, "price": (2.0, 8.0)},
+    "gpt-4.1":         {"latency": 3.0,  "price": (2.0, 8.0)},
+    "o1":              {"latency": 30.0, "price": (15.0, 60.0)},
+    "gpt-4.5-preview": {"latency": 10.0, "price": (75.0, 150.0)},
+    "gpt-4o":          {"latency": 2.0,  "price": (2.5, 10.0)},
+    "codex-mini":      {"latency": 10.0, "price": (1.5, 6.0)},
+    "o3-mini":         {"latency": 8.0,  "price": (1.1, 4.4)},
+    "gpt-4.1-mini":    {"latency": 1.5,  "price": (0.4, 1.6)},
+    "gpt-4":           {"latency": 6.0,  "price": (10.0, 30.0)},
+    "gpt-4-32k":       {"latency": 8.0,  "price": (60.0, 120.0)},
+    "gpt-35-turbo":    {"latency": 1.0,  "price": (0.5, 1.5)},
+    "gpt-4.1-nano":    {"latency": 0.5,  "price": (0.1, 0.4)},
+}
+# Conservative prior for deployments missing from the table.
+DEFAULT_PROFILE = {"latency": 30.0, "price": (15.0, 60.0)}
+# Errors that make the router try a faster model instead.
+FALLBACK_ERRORS = (openai.RateLimitError, openai.APITimeoutError,
+                   openai.APIConnectionError, openai.InternalServerError)
+
+
+class LatencyTracker:
+    """Rolling per-model latencies (p50/p95) and throttling cool-downs."""
+
+    def __init__(self, window=200, min_samples=5):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}
+        self._throttled_until = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, seconds):
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def throttle(self, model, seconds=30.0):
+        with self._lock:
+            self._throttled_until[model] = time.monotonic() + seconds
+
+    def is_throttled(self, model):
+        return self._throttled_until.get(model, 0.0) > time.monotonic()
+
+    def percentile(self, model, q):
+        """Measured *q*-quantile (0-1), or ``None`` with too few samples."""
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def stats(self):
+        return {m: {"n": len(s), "p50": self.percentile(m, 0.5), "p95": self.percentile(m, 0.95),
+                    "throttled": self.is_throttled(m)}
+                for m, s in self._samples.items()}
+
+
+class ModelRouter:
+    """Pick a model per request from prompt size, latency SLO and cost cap.
+
+    *candidates* is an explicit preference ranking, best first.  Without one
+    the global ``model`` is preferred and the other ``MODEL_PROFILES`` models
+    only serve as fallbacks, ranked by latency – the table says nothing about
+    quality.  ``route`` keeps the models whose context window fits the prompt,
+    whose estimated cost stays under *max_cost* (USD) and whose p95 latency –
+    live if measured, else 1.5 × the prior – meets *slo* (seconds), skipping
+    throttled deployments.  Deployments missing from the table use
+    ``DEFAULT_PROFILE`` until measured.  The highest ranked one is tried
+    first, without SDK retries; ``process`` falls back to the faster ones,
+    lowest p50 first, as soon as it is throttled, times out or fails.
+    """
+
+    def __init__(self, candidates=None, tracker=None, expected_output_tokens=1_000,
+                 timeout_factor=2.0):
+        self.candidates = list(candidates) if candidates else None
+        self.tracker = tracker or LatencyTracker()
+        self.expected_output_tokens = expected_output_tokens
+        self.timeout_factor = timeout_factor
+
+    @staticmethod
+    def profile(model):
+        return MODEL_PROFILES.get(model, DEFAULT_PROFILE)
+
+    def p50(self, model):
+        measured = self.tracker.percentile(model, 0.5)
+        return measured if measured is not None else self.profile(model)["latency"]
+
+    def p95(self, model):
+        measured = self.tracker.percentile(model, 0.95)
+        return measured if measured is not None else 1.5 * self.profile(model)["latency"]
+
+    def cost(self, model, prompt_tokens):
+        price_in, price_out = self.profile(model)["price"]
+        return (prompt_tokens * price_in + self.expected_output_tokens * price_out) / 1e6
+
+    def ranking(self):
+        """Candidates in preference order (see the class docstring)."""
+        if self.candidates:
+            return self.candidates
+        preferred = globals()["model"]
+        return [preferred] + sorted((m for m in MODEL_PROFILES if m != preferred), key=self.p50)
+
+    def route(self, msg, slo=None, max_cost=None):
+        """Models to try for *msg*, in order: the chosen one, then faster fallbacks."""
+        prompt_tokens = sum(message_tokens(m) for m in msg)
+        candidates = self.ranking()
+        fits = [m for m in candidates if prompt_tokens <= token_budget(m)]
+        affordable = [m for m in fits if max_cost is None or self.cost(m, prompt_tokens) <= max_cost]
+        eligible = [m for m in affordable if not self.tracker.is_throttled(m)
+                    and (slo is None or self.p95(m) <= slo)]
+        if not eligible:
+            # Nothing meets the SLO – go for the fastest model we may use.
+            eligible = sorted(affordable or fits or candidates, key=self.p50)
+        chosen = eligible[0]
+        faster = sorted((m for m in eligible[1:] if self.p50(m) < self.p50(chosen)), key=self.p50)
+        return [chosen] + faster
+
+    def process(self, system_message, combined_history, slo=None, max_cost=None):
+        """Like ``process_message``, routed; returns ``(response, model_used)``."""
+        msg = [system_message, *combined_history]
+        order = self.route(msg, slo, max_cost)
+        for attempt, name in enumerate(order):
+            timeout = self.timeout_factor * slo if slo else None
+            start = time.perf_counter()
+            try:
+                # The SDK's own retries would hold us on a throttled deployment.
+                response = _send(name, msg, timeout=timeout, max_retries=0)
+            except FALLBACK_ERRORS as e:
+                if isinstance(e, openai.APITimeoutError):
+                    self.tracker.record(name, time.perf_counter() - start)
+                headers = getattr(getattr(e, "response", None), "headers", None) or {}
+                try:
+                    cool_down = float(headers.get("retry-after", 30.0))
+                except ValueError:
+                    cool_down = 30.0
+                self.tracker.throttle(name, cool_down)
+                if attempt == len(order) - 1:
+                    print(f"Unexpected {traceback.format_exc()}, {type(e)=}")
+                    return str({traceback.format_exc()}), name
+                print(f"{name} failed ({type(e).__name__}) – falling back to {order[attempt + 1]}")
+                continue
+            except Exception as e:
+                print(f"Unexpected {traceback.format_exc()}, {type(e)=}")
+                return str({traceback.format_exc()}), name
+            self.tracker.record(name, time.perf_counter() - start)
+            return response, name
+
+
+# ─── Async, pooled clients ─────────────────────────────────────────────────
+# Concurrent requests allowed per model; anything not listed gets the default.
+MODEL_CONCURRENCY = {"o3-pro": 2, "o3": 4, "o1": 4}
+DEFAULT_MODEL_CONCURRENCY = 8
+
+
+class AsyncClientPool:
+    """One ``AsyncAzureOpenAI`` client per model on a shared keep-alive pool.
+
+    All clients send through the same ``httpx.AsyncClient``, so TCP/TLS
+    connections are reused across models and requests.  ``limit(model)``
+    bounds the requests in flight per model (see ``MODEL_CONCURRENCY``).
+    Create and use a pool inside one event loop; close it with ``aclose()``
+    or ``async with``.
+    """
+
+    def __init__(self, max_connections=64, max_keepalive=32, concurrency=None):
+        self.concurrency = {**MODEL_CONCURRENCY, **(concurrency or {})}
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive),
+            timeout=httpx.Timeout(600.0, connect=10.0),
+        )
+        self._clients = {}
+        self._limits = {}
+
+    def client(self, model):
+        if model not in self._clients:
+            self._clients[model] = AsyncAzureOpenAI(
+                azure_endpoint=AZURE_ENDPOINT,
+                azure_deployment=model,
+                api_key=OPENAI_API_KEY,
+                api_version=API_VERSION,
+                http_client=self._http,
+            )
+        return self._clients[model]
+
+    def limit(self, model):
+        if model not in self._limits:
+            self._limits[model] = asyncio.Semaphore(
+                self.concurrency.get(model, DEFAULT_MODEL_CONCURRENCY))
+        return self._limits[model]
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+
+async def process_message_async(system_message, combined_history, pool, model=None):
+    """Async ``process_message`` for *model* (default: the global ``model``)."""
+    model = model or globals()["model"]
+    try:
+        msg = [system_message, *combined_history]
+        key = _cache_key(model, msg) if response_cache is not None else None
+        cached = response_cache.get(key) if key else None
+        if cached is not None:
+            return cached
+
+        client = pool.client(model)
+        async with pool.limit(model):
+            if model in RESPONSES_API_MODELS:
+                response = _parse_responses_output(
+                    await client.responses.create(input=msg, model=model))
+            else:
+                response = _parse_chat_response(
+                    await client.chat.completions.create(**_chat_params(model, msg)))
+        if key:
+            response_cache.put(key, model, response)
+        return response
 
     except Exception as e:
         print(f"Unexpected {traceback.format_exc()}, {type(e)=}")
         return str({traceback.format_exc()})
-    
+
+
+def process_messages_batch(system_message, histories, models=None):
+    """Run many conversations concurrently; results come back in input order.
+
+    *models* is one model name for every history, or a list with one model
+    per history – e.g. ``process_messages_batch(sys_msg, [history] * 3,
+    ["o3", "gpt-4.1", "gpt-4o"])`` fans one conversation out to three models.
+    Per-model concurrency is bounded by the pool; a failing request returns
+    the same error string as ``process_message`` without affecting the rest.
+    Call from synchronous code; inside an event loop await
+    ``process_message_async`` directly.
+    """
+    if models is None or isinstance(models, str):
+        models = [models or model] * len(histories)
+    if len(models) != len(histories):
+        raise ValueError("models must be a single name or one per history")
+
+    async def run():
+        async with AsyncClientPool() as pool:
+            return await asyncio.gather(*(
+                process_message_async(system_message, history, pool, name)
+                for history, name in zip(histories, models)
+            ))
+
+    return list(asyncio.run(run()))
+
+
 if __name__ == "__main__":
     system_message = {"role": "system", "content": "You are a helpful assistant."}
     prompt = {"role": "user", "content": "hello"}
-    combined_history = combined_history + [prompt]
+    if "--cache" in sys.argv:
+        enable_response_cache()
+    conversation = ConversationStore(system_message, summarize=summarize_with())
+    conversation.add(prompt)
+    system_message, combined_history = conversation.request(model)
 
-    response = process_message(system_message, combined_history)
-    combined_history = combined_history + [response]
-    print(response)
\ No newline at end of file
+    if "--stream" in sys.argv:
+        for event in process_message_stream(system_message, combined_history):
+            if event["type"] == "text":
+                print(event["delta"], end="", flush=True)
+            elif event["type"] == "done":
+                response = event["result"]
+                ttft = "n/a" if event["ttft"] is None else f"{event['ttft']:.2f}s"
+                print(f"\n[time to first token: {ttft}, total: {event['elapsed']:.2f}s]")
+    else:
+        response = process_message(system_message, combined_history)
+        print(response)
+    conversation.add_response(response)
+    if response_cache is not None:
+        print(f"[response cache: {response_cache.stats()}]")
\ No newline at end of file